@@ -1,24 +1,30 @@
 """In-memory activity log for URL operations (for display on frontend)."""
+import threading
+import time
+from collections import deque
 from datetime import datetime, timezone
-from typing import List, Dict, Any
+from itertools import islice
+from typing import Deque, List, Dict, Any
 
 _MAX_ENTRIES = 100
-_entries: List[Dict[str, Any]] = []
+_UTC = timezone.utc
+# Ring buffer: appending past maxlen drops the oldest entry in O(1)
+_entries: Deque[Dict[str, Any]] = deque(maxlen=_MAX_ENTRIES)
+_lock = threading.Lock()
 
 
 def add(entry: Dict[str, Any]) -> None:
-    """Append an entry (ts added automatically)."""
+    """Append an entry (ts added automatically; formatted to ISO only when read)."""
     row = {
-        "ts": datetime.now(timezone.utc).isoformat(),
+        "ts": time.time(),
         **entry,
     }
-    _entries.append(row)
-    while len(_entries) > _MAX_ENTRIES:
-        _entries.pop(0)
+    with _lock:
+        _entries.append(row)
 
 
 def get(limit: int = 50) -> List[Dict[str, Any]]:
     """Return last `limit` entries, newest first."""
-    out = _entries[-limit:]
-    out.reverse()
-    return out
+    with _lock:
+        rows = list(islice(reversed(_entries), max(limit, 0)))
+    return [{**e, "ts": datetime.fromtimestamp(e["ts"], _UTC).isoformat()} for e in rows]
@@ -1,36 +1,91 @@
 """Database setup and session management."""
-from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
 import os
+import orjson
 
-# SQLite database directory: backend/data when run locally, /app/data in Docker
-DB_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "data"))
+# SQLite database directory: APP_DATA_DIR if set, else /app/data in Docker, else backend/data when run locally
+DB_DIR = os.getenv("APP_DATA_DIR") or (
+    "/app/data" if os.path.isdir("/app/data")
+    else os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "data"))
+)
 os.makedirs(DB_DIR, exist_ok=True)
 DB_PATH = os.path.join(DB_DIR, "appletv.db")
 
 # Use absolute path for SQLite (or DATABASE_URL env if set, e.g. in Docker)
 DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DB_PATH}")
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
+
+def _async_url(url: str) -> str:
+    """Map a plain URL (as in .env / docker-compose) to its asyncio driver: aiosqlite or asyncpg."""
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    if url.startswith("postgresql://"):
+        return "postgresql+asyncpg://" + url[len("postgresql://"):]
+    return url
+
+
+ASYNC_DATABASE_URL = _async_url(DATABASE_URL)
+
+# Keep connections open between requests so SQLite's per-connection page cache survives
+if "sqlite" in DATABASE_URL and ":memory:" in DATABASE_URL:
+    # In-memory DB lives only as long as its connection: share one
+    _pool_kwargs = {"poolclass": StaticPool}
+elif "sqlite" in DATABASE_URL:
+    _pool_kwargs = {"poolclass": AsyncAdaptedQueuePool, "pool_size": int(os.getenv("DB_POOL_SIZE", "5")), "max_overflow": 10}
+else:
+    _pool_kwargs = {
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": 20,
+        "pool_pre_ping": True,
+        "pool_recycle": 3600,
+    }
+
+engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
+    json_serializer=lambda obj: orjson.dumps(obj).decode(),
+    json_deserializer=orjson.loads,
+    **_pool_kwargs,
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if "sqlite" in DATABASE_URL:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_con, _):
+        """WAL lets readers run alongside the writer; NORMAL sync is safe under WAL and avoids fsync per commit."""
+        cur = dbapi_con.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA cache_size=-64000")  # ~64MB page cache
+        cur.execute("PRAGMA mmap_size=268435456")  # 256MB
+        cur.close()
+
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
 
-def get_db():
+async def get_db():
     """Dependency for getting database session."""
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-def init_db():
-    """Initialize database tables."""
-    Base.metadata.create_all(bind=engine)
+def _create_schema(sync_conn) -> None:
+    Base.metadata.create_all(bind=sync_conn)
+    # create_all skips existing tables, so add indexes introduced after the table was created
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=sync_conn, checkfirst=True)
+
+
+async def init_db():
+    """Initialize database tables and indexes, then refresh planner statistics."""
+    async with engine.begin() as conn:
+        await conn.run_sync(_create_schema)
+        if "sqlite" in DATABASE_URL:
+            await conn.exec_driver_sql("ANALYZE")
@@ -0,0 +1,61 @@
+"""Debounced Device.last_seen updates: recorded in memory, written to the DB in one transaction periodically."""
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Dict
+
+from sqlalchemy import bindparam, update
+
+from app.database import SessionLocal
+from app.models import Device
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SEC = 30.0
+_pending: Dict[str, datetime] = {}
+_lock = threading.Lock()
+
+_UPDATE_LAST_SEEN = (
+    update(Device.__table__)
+    .where(Device.__table__.c.device_id == bindparam("b_device_id"))
+    .values(last_seen=bindparam("b_last_seen"))
+)
+
+
+def touch(device_id: str) -> None:
+    """Mark device as seen now (persisted on next flush)."""
+    with _lock:
+        _pending[device_id] = datetime.now()
+
+
+async def flush() -> int:
+    """Write pending last_seen values in a single transaction. Returns number of devices written."""
+    with _lock:
+        if not _pending:
+            return 0
+        batch = [{"b_device_id": k, "b_last_seen": v} for k, v in _pending.items()]
+        _pending.clear()
+    try:
+        async with SessionLocal() as db:
+            await db.execute(_UPDATE_LAST_SEEN, batch)
+            await db.commit()
+    except Exception as e:
+        logger.warning("last_seen flush failed (%s devices), retrying next flush: %s", len(batch), e)
+        # Put the batch back unless the device was touched again meanwhile (that timestamp is newer)
+        with _lock:
+            for row in batch:
+                _pending.setdefault(row["b_device_id"], row["b_last_seen"])
+        return 0
+    return len(batch)
+
+
+async def flush_loop(interval: float = FLUSH_INTERVAL_SEC) -> None:
+    """Flush pending updates every `interval` seconds until cancelled; flushes once more on cancel."""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await flush()
+    except asyncio.CancelledError:
+        await flush()
+        raise
@@ -1,8 +1,13 @@
 """FastAPI application main file."""
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 import logging
-from app.database import init_db
+import os
+from app.database import engine, init_db
+from app import last_seen_buffer, stream_merge
+from app.middleware.cors import FastCORS
 from app.routers import appletv
 
 # Configure logging
@@ -12,29 +17,36 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Deep Link Apple TV API", version="1.0.0")
-
-# CORS — для локального проекта разрешаем любые origins (в т.ч. по IP с другого устройства)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_origin_regex=r"https?://.*",  # на случай если "*" не срабатывает в части окружений
-    allow_credentials=False,
-    allow_methods=["*"],
-    allow_headers=["*"],
-    expose_headers=["*"],
-)
-
-# Include routers
-app.include_router(appletv.router)
 
-
-@app.on_event("startup")
-async def startup_event():
-    """Initialize database on startup."""
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize database on startup, warm up yt-dlp workers; run last_seen flusher and stream session reaper until shutdown,
+    then release Apple TV service resources."""
     logger.info("Initializing database...")
-    init_db()
+    await init_db()
     logger.info("Database initialized")
+    flush_task = asyncio.create_task(last_seen_buffer.flush_loop())
+    reap_task = asyncio.create_task(stream_merge.reap_sessions_loop())
+    # First play shouldn't pay for starting yt-dlp workers
+    warmup_task = asyncio.create_task(appletv.appletv_service.warmup())
+    yield
+    warmup_task.cancel()
+    reap_task.cancel()
+    flush_task.cancel()
+    await appletv.appletv_service.shutdown()
+    # flush_task writes pending last_seen values on cancel: wait for it (and the others) before closing the DB
+    await asyncio.gather(warmup_task, reap_task, flush_task, return_exceptions=True)
+    await engine.dispose()
+
+
+app = FastAPI(title="Deep Link Apple TV API", version="1.0.0", default_response_class=ORJSONResponse, lifespan=lifespan)
+
+# CORS — по умолчанию разрешаем любые origins (в т.ч. по IP с другого устройства); CORS_ORIGINS — список через запятую
+CORS_ORIGINS = tuple(o.strip() for o in os.getenv("CORS_ORIGINS", "*").split(",") if o.strip()) or ("*",)
+app.add_middleware(FastCORS, allow_origins=CORS_ORIGINS)
+
+# Include routers
+app.include_router(appletv.router)
 
 
 @app.get("/")
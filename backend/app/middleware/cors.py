@@ -0,0 +1,76 @@
+"""Pure-ASGI CORS middleware: patches headers on http.response.start, no Request/Response objects per call."""
+from typing import Iterable, List, Tuple
+
+_ALL_METHODS = "DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+
+
+class FastCORS:
+    """CORS for every HTTP response; answers preflight (OPTIONS) without reaching the app."""
+
+    def __init__(
+        self,
+        app,
+        allow_origins: Iterable[str] = ("*",),
+        allow_methods: Iterable[str] = ("*",),
+        allow_headers: Iterable[str] = ("*",),
+        expose_headers: Iterable[str] = ("*",),
+        max_age: int = 600,
+    ):
+        self.app = app
+        self.allow_origins = frozenset(allow_origins)
+        self.allow_all_origins = "*" in self.allow_origins
+        methods = tuple(allow_methods)
+        self.allow_methods = (_ALL_METHODS if "*" in methods else ", ".join(methods)).encode()
+        headers = tuple(allow_headers)
+        self.allow_all_headers = "*" in headers
+        self.allow_headers = ", ".join(headers).encode()
+        self.expose_headers = ", ".join(expose_headers).encode()
+        self.max_age = str(max_age).encode()
+
+    def _origin_headers(self, origin: bytes) -> List[Tuple[bytes, bytes]]:
+        if self.allow_all_origins:
+            return [(b"access-control-allow-origin", b"*")]
+        return [(b"access-control-allow-origin", origin), (b"vary", b"Origin")]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        origin = None
+        request_method = None
+        request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+        if origin is None or not (self.allow_all_origins or origin.decode("latin-1") in self.allow_origins):
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            # Preflight: answer here
+            headers = self._origin_headers(origin) + [
+                (b"access-control-allow-methods", self.allow_methods),
+                (b"access-control-max-age", self.max_age),
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", b"2"),
+            ]
+            if self.allow_all_headers and request_headers is not None:
+                headers.append((b"access-control-allow-headers", request_headers))
+            elif not self.allow_all_headers:
+                headers.append((b"access-control-allow-headers", self.allow_headers))
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            await send({"type": "http.response.body", "body": b"OK"})
+            return
+
+        extra = self._origin_headers(origin) + [(b"access-control-expose-headers", self.expose_headers)]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", ())) + extra
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,5 +1,5 @@
 """Database models."""
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, ForeignKey, Index
 from sqlalchemy.sql import func
 from app.database import Base
 
@@ -7,12 +7,17 @@ from app.database import Base
 class Device(Base):
     """Apple TV device model."""
     __tablename__ = "devices"
+    __table_args__ = (
+        # SQLite has no INCLUDE: compose the key so device_id lookups for address/name stay in the index
+        Index("ix_devices_device_id_cover", "device_id", "address", "name"),
+        Index("ix_devices_last_seen", "last_seen"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     device_id = Column(String, unique=True, index=True, nullable=False)
     name = Column(String, nullable=False)
     address = Column(String, nullable=False)  # IP address
-    protocols = Column(Text)  # JSON array of supported protocols
+    protocols = Column(JSON)  # list of supported protocols (stored as JSON text)
     credentials = Column(Text)  # JSON blob of pyatv credentials
     last_seen = Column(DateTime(timezone=True))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -25,7 +30,7 @@ class DefaultDevice(Base):
     """Default Apple TV device selection."""
     __tablename__ = "default_device"
 
-    device_id = Column(String, primary_key=True, index=True)
+    device_id = Column(String, ForeignKey("devices.device_id"), primary_key=True, index=True)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
     def __repr__(self):
@@ -1,16 +1,21 @@
 """Apple TV API routes."""
 from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Tuple
+from datetime import datetime
 from pydantic import BaseModel
 import logging
 
 from app.database import get_db
-from app.stream_merge import stream_merged_mp4_async, get_merge_session, wait_first_chunk_merge
+from app.stream_merge import stream_merged_mp4_async, get_merge_session, mark_requested, wait_first_chunk_merge
 from app.models import Device, DefaultDevice
+from app.services.storage_service import parse_credentials_cached
 from app.services.appletv_service import AppleTVService
 from app.activity_log import add as log_add, get as log_get
+from app import last_seen_buffer
 
 logger = logging.getLogger(__name__)
 
@@ -71,69 +76,112 @@ class ApiResponse(BaseModel):
     error: Optional[dict] = None
 
 
-def success_response(data: dict) -> ApiResponse:
+# Responses are plain dicts shaped like ApiResponse; the model is only used for OpenAPI docs
+API_RESPONSES = {200: {"model": ApiResponse}}
+
+
+def success_response(data: dict) -> dict:
     """Create success response."""
-    return ApiResponse(ok=True, data=data)
+    return {"ok": True, "data": data, "error": None}
 
 
-def error_response(code: str, message: str, details: Optional[dict] = None) -> ApiResponse:
+def error_response(code: str, message: str, details: Optional[dict] = None) -> dict:
     """Create error response."""
-    return ApiResponse(
-        ok=False,
-        error={"code": code, "message": message, "details": details or {}}
-    )
+    return {
+        "ok": False,
+        "data": None,
+        "error": {"code": code, "message": message, "details": details or {}},
+    }
+
+
+def _insert_for(db: AsyncSession):
+    """Dialect insert() that supports on_conflict_do_update (SQLite or PostgreSQL)."""
+    return postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+
+
+async def _get_device(db: AsyncSession, device_id: str) -> Optional[Device]:
+    """Look up a device by its unique device_id."""
+    return (await db.execute(select(Device).where(Device.device_id == device_id))).scalar_one_or_none()
+
+
+async def _get_default_device(db: AsyncSession) -> Tuple[Optional[DefaultDevice], Optional[Device]]:
+    """Default selection and its device in one query; device is None if the default points nowhere."""
+    row = (await db.execute(
+        select(DefaultDevice, Device).outerjoin(Device, Device.device_id == DefaultDevice.device_id)
+    )).first()
+    if row is None:
+        return None, None
+    return row[0], row[1]
 
 
-@router.get("/scan", response_model=ApiResponse)
+@router.get("/scan", responses=API_RESPONSES)
 async def scan_devices():
     """Scan for Apple TV devices on the local network."""
     try:
-        devices = await appletv_service.scan_devices()
+        # Repeated refresh clicks within a few seconds reuse the last sweep
+        devices = await appletv_service.scan_devices_cached()
         return success_response({"devices": devices})
     except Exception as e:
-        logger.error(f"Scan error: {e}", exc_info=True)
+        logger.error("Scan error: %s", e, exc_info=True)
         return error_response("SCAN_FAILED", str(e))
 
 
-@router.get("/devices", response_model=ApiResponse)
-async def get_paired_devices(db: Session = Depends(get_db)):
+def _paired_protocols(raw_creds) -> List[str]:
+    """Protocols with stored credentials; raw_creds is parse_credentials_cached output:
+    { identifier: { "airplay": "...", "companion": "..." } } (protocol keys lowercased)."""
+    paired_protocols = []
+    for creds_dict in (raw_creds.values() if isinstance(raw_creds, dict) else []):
+        if isinstance(creds_dict, dict):
+            for p in ("airplay", "companion", "mrp"):
+                if creds_dict.get(p) and p not in paired_protocols:
+                    paired_protocols.append(p)
+            break
+    return paired_protocols
+
+
+@router.get("/devices", responses=API_RESPONSES)
+async def get_paired_devices(db: AsyncSession = Depends(get_db)):
     """Get list of paired devices."""
     try:
-        devices = db.query(Device).all()
-        result = []
-        for device in devices:
-            import json
-            protocols = json.loads(device.protocols) if device.protocols else []
-            raw_creds = json.loads(device.credentials) if device.credentials else {}
-            # raw_creds is { identifier: { "AirPlay": "...", "Companion": "..." } }
-            paired_protocols = []
-            for creds_dict in (raw_creds.values() if isinstance(raw_creds, dict) else []):
-                if isinstance(creds_dict, dict):
-                    for proto in ("AirPlay", "Companion", "MRP"):
-                        if creds_dict.get(proto):
-                            p = proto.lower()
-                            if p not in paired_protocols:
-                                paired_protocols.append(p)
-                    break
-            is_paired = bool(raw_creds and raw_creds != {})
-            
-            result.append({
+        rows = (await db.execute(
+            select(Device, DefaultDevice.device_id).outerjoin(DefaultDevice, Device.device_id == DefaultDevice.device_id)
+        )).all()
+        result = [
+            {
                 "id": device.id,
                 "device_id": device.device_id,
                 "name": device.name,
                 "address": device.address,
-                "protocols": protocols,
-                "paired_protocols": paired_protocols,
-                "is_paired": is_paired,
+                "protocols": device.protocols or [],
+                "paired_protocols": _paired_protocols(parse_credentials_cached(device.credentials)),
+                "is_paired": bool(parse_credentials_cached(device.credentials)),  # cached: same string, no re-parse
+                "is_default": default_id is not None,
                 "last_seen": device.last_seen.isoformat() if device.last_seen else None,
                 "created_at": device.created_at.isoformat() if device.created_at else None,
-            })
+            }
+            for device, default_id in rows
+        ]
         return success_response({"devices": result})
     except Exception as e:
-        logger.error(f"Get devices error: {e}", exc_info=True)
+        logger.error("Get devices error: %s", e, exc_info=True)
         return error_response("GET_DEVICES_FAILED", str(e))
 
 
+def _parse_range(header: Optional[str]) -> Optional[Tuple[int, Optional[int]]]:
+    """Parse a single `bytes=start-[end]` Range header; None if absent or not of that form."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, _, end_s = header[6:].strip().partition("-")
+    try:
+        start = int(start_s)
+        end = int(end_s) if end_s else None
+    except ValueError:
+        return None
+    if end is not None and end < start:
+        return None
+    return start, end
+
+
 @router.get("/stream/{stream_id}")
 async def stream_merged(stream_id: str, request: Request):
     """Stream merged video+audio (e.g. YouTube 1080p). Used by Apple TV when playing merge URL.
@@ -144,25 +192,37 @@ async def stream_merged(stream_id: str, request: Request):
     logger.info("[stream %s] Stream requested from %s (User-Agent: %s) (GET /stream/%s)", stream_id, client_host, user_agent[:50], stream_id)
     session = get_merge_session(stream_id)
     if session:
-        session["requested"] = True  # Mark that Apple TV requested the stream
+        mark_requested(session)  # Mark that Apple TV requested the stream
     if not session:
         raise HTTPException(status_code=404, detail="Stream not found or expired")
-    if "consumers" in session:
-        first_chunk, q, unregister = await wait_first_chunk_merge(stream_id, timeout=25.0)
-        if first_chunk is None or q is None:
-            logger.warning("[stream %s] No first chunk in time, returning 503", stream_id)
-            raise HTTPException(status_code=503, detail="Stream not ready; try again in a few seconds")
-        return StreamingResponse(
-            stream_merged_mp4_async(stream_id, first_chunk=first_chunk, chunk_queue=q, unregister_cb=unregister),
+    first_chunk, q, unregister = await wait_first_chunk_merge(stream_id, timeout=25.0)
+    if first_chunk is None or q is None:
+        logger.warning("[stream %s] No first chunk in time, returning 503", stream_id)
+        raise HTTPException(status_code=503, detail="Stream not ready; try again in a few seconds")
+    # Live fMP4 has no total length: only ranges inside the already-buffered head can be served
+    # as 206 (e.g. player probes like bytes=0-1), and only while that head still starts at offset 0;
+    # anything else gets the full stream as before.
+    byte_range = _parse_range(request.headers.get("range"))
+    if (
+        byte_range
+        and byte_range[1] is not None
+        and byte_range[1] < len(first_chunk)
+        and session.get("buffer_offset", 0) == 0
+    ):
+        unregister()
+        start, end = byte_range
+        return Response(
+            content=first_chunk[start:end + 1],
+            status_code=206,
             media_type="video/mp4",
             headers={
                 "Cache-Control": "no-store, no-cache, must-revalidate",
                 "Accept-Ranges": "bytes",
-                "Content-Type": "video/mp4",
+                "Content-Range": f"bytes {start}-{end}/*",
             },
         )
     return StreamingResponse(
-        stream_merged_mp4_async(stream_id),
+        stream_merged_mp4_async(stream_id, first_chunk=first_chunk, chunk_queue=q, unregister_cb=unregister),
         media_type="video/mp4",
         headers={
             "Cache-Control": "no-store, no-cache, must-revalidate",
@@ -172,54 +232,51 @@ async def stream_merged(stream_id: str, request: Request):
     )
 
 
-@router.get("/activity", response_model=ApiResponse)
+@router.get("/activity", responses=API_RESPONSES)
 async def get_activity(limit: int = 50):
     """Get recent URL operation log (newest first)."""
     try:
         entries = log_get(limit=min(limit, 100))
         return success_response({"entries": entries})
     except Exception as e:
-        logger.error(f"Get activity error: {e}", exc_info=True)
+        logger.error("Get activity error: %s", e, exc_info=True)
         return error_response("GET_ACTIVITY_FAILED", str(e))
 
 
-@router.delete("/devices/{device_id}", response_model=ApiResponse)
-async def delete_device(device_id: str, db: Session = Depends(get_db)):
+@router.delete("/devices/{device_id}", responses=API_RESPONSES)
+async def delete_device(device_id: str, db: AsyncSession = Depends(get_db)):
     """Remove a device from the database."""
     try:
-        device = db.query(Device).filter(Device.device_id == device_id).first()
+        device = await _get_device(db, device_id)
         if not device:
             return error_response("DEVICE_NOT_FOUND", f"Device {device_id} not found")
         # Clear default if this device was default
-        default = db.query(DefaultDevice).filter(DefaultDevice.device_id == device_id).first()
-        if default:
-            db.delete(default)
-        db.delete(device)
-        db.commit()
+        await db.execute(delete(DefaultDevice).where(DefaultDevice.device_id == device_id))
+        await db.delete(device)
+        await db.commit()
         return success_response({"message": "Device removed"})
     except Exception as e:
-        logger.error(f"Delete device error: {e}", exc_info=True)
+        logger.error("Delete device error: %s", e, exc_info=True)
         return error_response("DELETE_DEVICE_FAILED", str(e))
 
 
-@router.patch("/devices/{device_id}", response_model=ApiResponse)
+@router.patch("/devices/{device_id}", responses=API_RESPONSES)
 async def update_device(
     device_id: str,
     request: UpdateDeviceRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Update device name or address."""
     try:
-        device = db.query(Device).filter(Device.device_id == device_id).first()
+        device = await _get_device(db, device_id)
         if not device:
             return error_response("DEVICE_NOT_FOUND", f"Device {device_id} not found")
         if request.name is not None:
             device.name = (request.name or "").strip() or device.name
         if request.address is not None:
             device.address = (request.address or "").strip() or device.address
-        db.commit()
-        import json
-        protocols = json.loads(device.protocols) if device.protocols else []
+        await db.commit()
+        protocols = device.protocols or []
         return success_response({
             "device": {
                 "id": device.id,
@@ -231,20 +288,20 @@ async def update_device(
             "message": "Device updated",
         })
     except Exception as e:
-        logger.error(f"Update device error: {e}", exc_info=True)
+        logger.error("Update device error: %s", e, exc_info=True)
         return error_response("UPDATE_DEVICE_FAILED", str(e))
 
 
-@router.post("/{device_id}/pair/start", response_model=ApiResponse)
+@router.post("/{device_id}/pair/start", responses=API_RESPONSES)
 async def start_pairing(
     device_id: str,
     request: PairStartRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Start pairing process with a device."""
     try:
         # Get device info from scan or database
-        device = db.query(Device).filter(Device.device_id == device_id).first()
+        device = await _get_device(db, device_id)
         
         if device:
             # Use stored device info
@@ -252,7 +309,7 @@ async def start_pairing(
             credentials_json = device.credentials
         else:
             # Device not in DB yet, need to scan
-            scanned = await appletv_service.scan_devices()
+            scanned = await appletv_service.scan_devices_cached()
             device_info = next((d for d in scanned if d["device_id"] == device_id), None)
             if not device_info:
                 return error_response("DEVICE_NOT_FOUND", f"Device {device_id} not found")
@@ -268,25 +325,25 @@ async def start_pairing(
         
         return success_response(result)
     except Exception as e:
-        logger.error(f"Start pairing error: {e}", exc_info=True)
+        logger.error("Start pairing error: %s", e, exc_info=True)
         return error_response("PAIRING_START_FAILED", str(e))
 
 
-@router.post("/{device_id}/pair/pin", response_model=ApiResponse)
+@router.post("/{device_id}/pair/pin", responses=API_RESPONSES)
 async def submit_pin(
     device_id: str,
     request: PairPinRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Submit PIN for pairing."""
     try:
-        device = db.query(Device).filter(Device.device_id == device_id).first()
+        device = await _get_device(db, device_id)
         credentials_json = device.credentials if device else None
         
         # Get device address and protocol from pairing session or device
         if not device:
             # Try to get from scan
-            scanned = await appletv_service.scan_devices()
+            scanned = await appletv_service.scan_devices_cached()
             device_info = next((d for d in scanned if d["device_id"] == device_id), None)
             if not device_info:
                 return error_response("DEVICE_NOT_FOUND", f"Device {device_id} not found")
@@ -295,8 +352,7 @@ async def submit_pin(
             protocol = device_info["protocols"][0] if device_info["protocols"] else "airplay"
         else:
             address = device.address
-            import json
-            protocols = json.loads(device.protocols) if device.protocols else []
+            protocols = device.protocols or []
             protocol = protocols[0] if protocols else "airplay"
         
         result = await appletv_service.submit_pin(
@@ -309,70 +365,61 @@ async def submit_pin(
         
         if result["status"] == "COMPLETED":
             # Save/update device in database with credentials
-            import json
-            from datetime import datetime
-            
             # Get updated credentials from result
             updated_credentials = result.get("credentials", credentials_json or "{}")
             
-            device = db.query(Device).filter(Device.device_id == device_id).first()
             if not device:
-                # Create new device entry
-                scanned = await appletv_service.scan_devices()
+                # Create new device entry (upsert: it may have been added while we were pairing)
+                scanned = await appletv_service.scan_devices_cached()
                 device_info = next((d for d in scanned if d["device_id"] == device_id), None)
-                if device_info:
-                    device = Device(
-                        device_id=device_id,
-                        name=device_info["name"],
-                        address=device_info["address"],
-                        protocols=json.dumps(device_info["protocols"]),
-                        credentials=updated_credentials,
-                        last_seen=datetime.now()
-                    )
-                    db.add(device)
-                else:
+                if not device_info:
                     # Create device entry with minimal info
-                    device = Device(
-                        device_id=device_id,
-                        name="Apple TV",
-                        address=address,
-                        protocols=json.dumps([protocol]),
-                        credentials=updated_credentials,
-                        last_seen=datetime.now()
-                    )
-                    db.add(device)
+                    device_info = {"name": "Apple TV", "address": address, "protocols": [protocol]}
+                stmt = _insert_for(db)(Device).values(
+                    device_id=device_id,
+                    name=device_info["name"],
+                    address=device_info["address"],
+                    protocols=device_info["protocols"],
+                    credentials=updated_credentials,
+                    last_seen=datetime.now(),
+                )
+                await db.execute(stmt.on_conflict_do_update(
+                    index_elements=[Device.device_id],
+                    set_={"credentials": stmt.excluded.credentials, "last_seen": stmt.excluded.last_seen},
+                ))
             else:
                 device.credentials = updated_credentials
-                device.last_seen = datetime.now()
+                last_seen_buffer.touch(device_id)
             
-            db.commit()
+            await db.commit()
         
         return success_response(result)
     except Exception as e:
-        logger.error(f"Submit PIN error: {e}", exc_info=True)
+        logger.error("Submit PIN error: %s", e, exc_info=True)
         return error_response("PAIRING_PIN_FAILED", str(e))
 
 
-@router.post("/play", response_model=ApiResponse)
-async def play_url(request: PlayRequest, db: Session = Depends(get_db)):
+@router.post("/play", responses=API_RESPONSES)
+async def play_url(request: PlayRequest, db: AsyncSession = Depends(get_db)):
     """Play a URL on Apple TV."""
     device_id = None
     device_name = ""
-    url_truncated = (request.url or "")[:80] + ("..." if len(request.url or "") > 80 else "")
+    url = request.url or ""
+    url_truncated = url if len(url) <= 80 else url[:80] + "..."
 
     try:
         device_id = request.device_id
 
         # If no device_id provided, use default
         if not device_id:
-            default = db.query(DefaultDevice).first()
+            default, device = await _get_default_device(db)
             if not default:
                 log_add({"status": "error", "url": url_truncated, "device": "", "message": "No default device set"})
                 return error_response("NO_DEFAULT_DEVICE", "No default device set")
             device_id = default.device_id
-
-        # Get device from database
-        device = db.query(Device).filter(Device.device_id == device_id).first()
+        else:
+            # Get device from database
+            device = await _get_device(db, device_id)
         if not device:
             log_add({"status": "error", "url": url_truncated, "device": "", "message": "Device not found"})
             return error_response("DEVICE_NOT_FOUND", f"Device {device_id} not found")
@@ -411,20 +458,19 @@ async def play_url(request: PlayRequest, db: Session = Depends(get_db)):
         return success_response(result)
     except Exception as e:
         err_msg = str(e)
-        log_add({"status": "error", "url": url_truncated, "device": device_name or (device_id or ""), "message": err_msg})
-        logger.error(f"Play URL error: {e}", exc_info=True)
+        log_add({"status": "error", "url": url_truncated, "device": device_name or device_id or "", "message": err_msg})
+        logger.error("Play URL error: %s", e, exc_info=True)
         return error_response("PLAY_FAILED", err_msg)
 
 
-@router.post("/stop", response_model=ApiResponse)
-async def stop_playback(db: Session = Depends(get_db)):
+@router.post("/stop", responses=API_RESPONSES)
+async def stop_playback(db: AsyncSession = Depends(get_db)):
     """Stop (pause) playback on default Apple TV."""
     try:
-        default = db.query(DefaultDevice).first()
+        default, device = await _get_default_device(db)
         if not default:
             log_add({"status": "error", "url": "", "device": "", "message": "Устройство по умолчанию не задано"})
             return error_response("NO_DEFAULT_DEVICE", "No default device set")
-        device = db.query(Device).filter(Device.device_id == default.device_id).first()
         if not device:
             log_add({"status": "error", "url": "", "device": "", "message": "Устройство не найдено"})
             return error_response("DEVICE_NOT_FOUND", "Device not found")
@@ -442,49 +488,41 @@ async def stop_playback(db: Session = Depends(get_db)):
         return success_response(result)
     except Exception as e:
         log_add({"status": "error", "url": "", "device": "", "message": str(e)})
-        logger.error(f"Stop playback error: {e}", exc_info=True)
+        logger.error("Stop playback error: %s", e, exc_info=True)
         return error_response("STOP_FAILED", str(e))
 
 
-@router.post("/default", response_model=ApiResponse)
-async def set_default_device(request: DefaultDeviceRequest, db: Session = Depends(get_db)):
+@router.post("/default", responses=API_RESPONSES)
+async def set_default_device(request: DefaultDeviceRequest, db: AsyncSession = Depends(get_db)):
     """Set default Apple TV device."""
     try:
         # Verify device exists
-        device = db.query(Device).filter(Device.device_id == request.device_id).first()
+        device = await _get_device(db, request.device_id)
         if not device:
             return error_response("DEVICE_NOT_FOUND", f"Device {request.device_id} not found")
         
-        # Update or create default device
-        default = db.query(DefaultDevice).first()
-        if default:
-            default.device_id = request.device_id
-        else:
-            default = DefaultDevice(device_id=request.device_id)
-            db.add(default)
+        # Update or create default device (single row): UPDATE first, INSERT only if there was none
+        updated = await db.execute(update(DefaultDevice).values(device_id=request.device_id))
+        if updated.rowcount == 0:
+            db.add(DefaultDevice(device_id=request.device_id))
         
-        db.commit()
+        await db.commit()
         
         return success_response({"device_id": request.device_id})
     except Exception as e:
-        logger.error(f"Set default device error: {e}", exc_info=True)
+        logger.error("Set default device error: %s", e, exc_info=True)
         return error_response("SET_DEFAULT_FAILED", str(e))
 
 
-@router.get("/default", response_model=ApiResponse)
-async def get_default_device(db: Session = Depends(get_db)):
+@router.get("/default", responses=API_RESPONSES)
+async def get_default_device(db: AsyncSession = Depends(get_db)):
     """Get default Apple TV device."""
     try:
-        default = db.query(DefaultDevice).first()
-        if not default:
-            return success_response({"device_id": None})
-        
-        device = db.query(Device).filter(Device.device_id == default.device_id).first()
+        _, device = await _get_default_device(db)
         if not device:
             return success_response({"device_id": None})
         
-        import json
-        protocols = json.loads(device.protocols) if device.protocols else []
+        protocols = device.protocols or []
         
         return success_response({
             "device_id": device.device_id,
@@ -493,12 +531,12 @@ async def get_default_device(db: Session = Depends(get_db)):
             "protocols": protocols,
         })
     except Exception as e:
-        logger.error(f"Get default device error: {e}", exc_info=True)
+        logger.error("Get default device error: %s", e, exc_info=True)
         return error_response("GET_DEFAULT_FAILED", str(e))
 
 
-@router.post("/add", response_model=ApiResponse)
-async def add_device_manually(request: AddDeviceRequest, db: Session = Depends(get_db)):
+@router.post("/add", responses=API_RESPONSES)
+async def add_device_manually(request: AddDeviceRequest, db: AsyncSession = Depends(get_db)):
     """Manually add an Apple TV device by IP address."""
     try:
         # Get device info from service
@@ -507,62 +545,44 @@ async def add_device_manually(request: AddDeviceRequest, db: Session = Depends(g
             name=request.name
         )
         
-        # Check if device already exists
-        existing = db.query(Device).filter(Device.device_id == device_info["device_id"]).first()
+        # Whether the row exists decides the response; the upsert below still covers a concurrent insert.
+        # last_seen is only written on insert; for existing rows it goes through the debounce buffer.
+        created = (await db.execute(
+            select(Device.id).where(Device.device_id == device_info["device_id"])
+        )).first() is None
+        stmt = _insert_for(db)(Device).values(
+            device_id=device_info["device_id"],
+            name=device_info["name"],
+            address=device_info["address"],
+            protocols=device_info["protocols"],
+            credentials="{}",  # Empty credentials, will be set during pairing
+            last_seen=datetime.now(),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Device.device_id],
+            set_={
+                "name": stmt.excluded.name,
+                "address": stmt.excluded.address,
+                "protocols": stmt.excluded.protocols,
+            },
+        ).returning(Device.id, Device.credentials)
+        row = (await db.execute(stmt)).one()
+        await db.commit()
+        if not created:
+            last_seen_buffer.touch(device_info["device_id"])
         
-        if existing:
-            # Update existing device
-            import json
-            from datetime import datetime
-            existing.name = device_info["name"]
-            existing.address = device_info["address"]
-            existing.protocols = json.dumps(device_info["protocols"])
-            existing.last_seen = datetime.now()
-            db.commit()
-            
-            # Check if actually paired
-            credentials = json.loads(existing.credentials) if existing.credentials else {}
-            is_paired = bool(credentials and credentials != {})
-            
-            return success_response({
-                "device": {
-                    "id": existing.id,
-                    "device_id": existing.device_id,
-                    "name": existing.name,
-                    "address": existing.address,
-                    "protocols": device_info["protocols"],
-                    "is_paired": is_paired,
-                },
-                "message": "Device updated",
-            })
-        else:
-            # Create new device entry
-            import json
-            from datetime import datetime
-            
-            device = Device(
-                device_id=device_info["device_id"],
-                name=device_info["name"],
-                address=device_info["address"],
-                protocols=json.dumps(device_info["protocols"]),
-                credentials="{}",  # Empty credentials, will be set during pairing
-                last_seen=datetime.now()
-            )
-            db.add(device)
-            db.commit()
-            db.refresh(device)
-            
-            return success_response({
-                "device": {
-                    "id": device.id,
-                    "device_id": device.device_id,
-                    "name": device.name,
-                    "address": device.address,
-                    "protocols": device_info["protocols"],
-                    "is_paired": False,  # Not paired yet, needs pairing
-                },
-                "message": "Device added successfully",
-            })
+        return success_response({
+            "device": {
+                "id": row.id,
+                "device_id": device_info["device_id"],
+                "name": device_info["name"],
+                "address": device_info["address"],
+                "protocols": device_info["protocols"],
+                # Check if actually paired (new devices need pairing)
+                "is_paired": not created and bool(parse_credentials_cached(row.credentials)),
+            },
+            "message": "Device added successfully" if created else "Device updated",
+        })
     except Exception as e:
-        logger.error(f"Add device error: {e}", exc_info=True)
+        logger.error("Add device error: %s", e, exc_info=True)
         return error_response("ADD_DEVICE_FAILED", str(e))
@@ -9,77 +9,531 @@ Deep link technology (borrowed from VidHub / Infuse):
 When no such app is installed, we fall back to AirPlay with server-side HLS→MP4 remux.
 """
 import asyncio
+import importlib.util
 import logging
 import os
-from typing import List, Optional, Dict, Any, Tuple, Union
+import re
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit, parse_qs, quote
+from typing import List, Optional, Dict, Any, Set, Tuple
 from pyatv import scan, pair, connect
 from pyatv.const import Protocol, PairingRequirement
-from pyatv.interface import AppleTV, PairingHandler
-from pyatv.exceptions import HttpError
-from app.services.storage_service import DatabaseStorage
+from pyatv.interface import AppleTV, DeviceListener, PairingHandler
+from pyatv.exceptions import ConnectionFailedError, ConnectionLostError, HttpError, OperationTimeoutError
+from app.services.storage_service import DatabaseStorage, parse_credentials_cached
+from app.stream_merge import (
+    create_hls_session,
+    create_merge_session,
+    get_video_audio_urls,
+    wait_for_request,
+    wait_hls_prewarm,
+)
+from app.ydl_pool import acquire_ydl, release_ydl
 
 logger = logging.getLogger(__name__)
 
-# Optional: resolve YouTube/page URLs to direct stream for AirPlay
-try:
-    import yt_dlp
-    HAS_YT_DLP = True
-except ImportError:
-    HAS_YT_DLP = False
-    yt_dlp = None
+# Optional: resolve YouTube/page URLs to direct stream for AirPlay. Only looked up here: yt_dlp itself
+# (hundreds of extractor modules) is imported by the resolver workers on first use
+HAS_YT_DLP = importlib.util.find_spec("yt_dlp") is not None
+
+# How long a full network scan is reused (refresh button, pairing flows looking up devices not yet in DB)
+_SCAN_CACHE_TTL_SEC = 10.0
+# How long a host-targeted scan result (pyatv config) is reused by play/stop/pairing
+_HOST_SCAN_TTL_SEC = 30.0
+# mDNS responders on a LAN answer in tens of ms; pyatv waits the full timeout for multicast scans
+_SCAN_TIMEOUT_SEC = 2.0
+_HOST_SCAN_TIMEOUT_SEC = 1.5
+# Hosts from the kernel ARP cache are also probed by unicast during a network scan (multicast may be
+# filtered, e.g. Docker bridge networking); at most this many
+_ARP_PATH = "/proc/net/arp"
+_ARP_SCAN_MAX = 64
+
+
+def _arp_neighbours() -> List[str]:
+    """IPv4 neighbours with a resolved MAC from the ARP cache; [] where unavailable (non-Linux, no access)."""
+    try:
+        with open(_ARP_PATH) as f:
+            lines = f.read().splitlines()[1:]
+    except OSError:
+        return []
+    hosts = []
+    for line in lines:
+        cols = line.split()
+        # Flags 0x0 = incomplete entry (no MAC learned)
+        if len(cols) >= 4 and cols[2] != "0x0" and cols[3] != "00:00:00:00:00:00":
+            hosts.append(cols[0])
+            if len(hosts) >= _ARP_SCAN_MAX:
+                break
+    return hosts
+
+
+# Bound mDNS/socket fan-out from bursty UI requests (primitives bind to the running loop on first use)
+_SCAN_SEM = asyncio.Semaphore(int(os.getenv("APPLETV_SCAN_CONCURRENCY", "4")))
+_CONNECT_SEM = asyncio.Semaphore(2)
+
+# yt-dlp worker processes (each keeps its own YoutubeDL pool)
+_YDL_WORKERS = int(os.getenv("YDL_WORKERS", "2"))
+
+# Resolved stream URLs per (url, quality); googlevideo links are signed for hours (expire= query param)
+_RESOLVE_CACHE_TTL_SEC = 3600.0
+_RESOLVE_CACHE_MAX = 128
+_EXPIRE_RE = re.compile(r"[?&/]expire[s]?[=/](\d+)")
+
+# App hosts handled as deep links; one case-insensitive scan instead of a substring test per host
+_DEEP_LINK_HOSTS = (
+    'tv.apple.com',
+    'disneyplus.com',
+    'netflix.com',
+    'hbomax.com',
+    'hulu.com',
+    'youtube.com',
+    'youtu.be',
+)
+_DEEP_LINK_RE = re.compile("|".join(re.escape(h) for h in _DEEP_LINK_HOSTS), re.IGNORECASE)
+# Direct media: known extension ending a path segment (or followed by a #fragment), or a common streaming path (query excluded)
+_DIRECT_MEDIA_RE = re.compile(r"\.(?:mp4|m4v|m3u8|ts|mov|webm|mkv)(?:[/#]|$)|/(?:stream|video|hls)/", re.IGNORECASE)
+_HLS_RE = re.compile(r"\.m3u8", re.IGNORECASE)
+# YouTube is recognised by hostname (one hash lookup), not by substring scans of the whole (often ~1KB) URL
+_YOUTUBE_HOSTS = frozenset({"youtube.com", "www.youtube.com", "m.youtube.com", "youtu.be"})
+
+
+def _url_host(url: str) -> str:
+    """Lowercased hostname, or "" if the URL has none or doesn't parse. urlsplit is memoised by the stdlib."""
+    try:
+        return urlsplit(url).hostname or ""
+    except ValueError:
+        return ""
+
+
+def _is_youtube_host(host: str) -> bool:
+    return host in _YOUTUBE_HOSTS or host.endswith(".youtube.com")
+
+
+_URL_DEEP_LINK = 1
+_URL_HLS = 2
+_URL_DIRECT_MEDIA = 4
+
+# Keys of a device's stored credentials per protocol (lowercased on load; older entries: a bare "credentials")
+_CRED_KEYS = (
+    (Protocol.AirPlay, ("airplay", "credentials")),
+    (Protocol.Companion, ("companion",)),
+    (Protocol.MRP, ("mrp",)),
+)
+
+
+def _pick_creds(creds_dict: Dict[str, Any], keys: Tuple[str, ...]) -> Any:
+    """First non-empty credentials under `keys`; a {"credentials": ...} wrapper is unwrapped."""
+    for key in keys:
+        value = creds_dict.get(key)
+        if value:
+            return (value.get("credentials") or value) if isinstance(value, dict) else value
+    return None
+
+
+# yt-dlp format string per quality setting
+_FORMAT_TABLE = {
+    # Prefer best combined format (video+audio) for AirPlay RTSP compatibility
+    # DASH-only streams (video-only or audio-only) cause RTSP SETUP 400 errors
+    "auto": "best[ext=mp4]/best",
+    # YouTube 1080p = DASH only; take bestvideo for resolution (video-only, no audio)
+    "1080p": "bestvideo[height<=1080][ext=mp4]/bestvideo[height<=1080]/best[height<=1080]/best",
+    "720p": "bestvideo[height<=720][ext=mp4]/bestvideo[height<=720]/best[height<=720]/best",
+    "480p": "best[height<=480][ext=mp4]/best[height<=480]/best",
+    "360p": "best[height<=360][ext=mp4]/best[height<=360]/best",
+}
+_FORMAT_DEFAULT = "best[ext=mp4]/best[ext=m4a]/best"
+
+# The same preferences as tiers (kind, max height, mp4 only) for picking from unprocessed extractor output.
+# kind "av" = combined video+audio ("best"), "v" = video-only ("bestvideo"); first tier with a match wins.
+_FORMAT_TIERS = {
+    "auto": (("av", None, True), ("av", None, False)),
+    "1080p": (("v", 1080, True), ("v", 1080, False), ("av", 1080, False), ("av", None, False)),
+    "720p": (("v", 720, True), ("v", 720, False), ("av", 720, False), ("av", None, False)),
+    "480p": (("av", 480, True), ("av", 480, False), ("av", None, False)),
+    "360p": (("av", 360, True), ("av", 360, False), ("av", None, False)),
+}
+_FORMAT_TIERS_DEFAULT = _FORMAT_TIERS["auto"]
+
+
+def _pick_format(info: Dict[str, Any], tiers) -> Optional[Dict[str, Any]]:
+    """Highest (height, tbr) progressive format of the first matching tier, from extract_info(process=False).
+    None for redirects/playlists or when nothing matches: the caller lets yt-dlp process the result instead."""
+    if info.get("_type", "video") != "video":
+        return None
+    formats = info.get("formats")
+    if not formats:
+        return info if info.get("url") else None
+    # Manifests (m3u8/dash) and storyboards are not single playable URLs; unknown codecs count as present
+    playable = [
+        f for f in formats
+        if f.get("url") and f.get("protocol", "https") in ("https", "http") and f.get("vcodec") != "none"
+    ]
+    for kind, max_height, mp4_only in tiers:
+        best, best_key = None, None
+        for f in playable:
+            if (f.get("acodec") == "none") != (kind == "v"):
+                continue
+            height = f.get("height") or 0
+            if (max_height and height > max_height) or (mp4_only and f.get("ext") != "mp4"):
+                continue
+            key = (height, f.get("tbr") or 0)
+            if best is None or key > best_key:
+                best, best_key = f, key
+        if best is not None:
+            return best
+    return None
+
+def _warm_ydl() -> None:
+    """Runs in a resolver worker: pay the process's import + extractor-registry cost before the first play."""
+    if HAS_YT_DLP:
+        format_str = _FORMAT_TABLE["auto"]
+        release_ydl(format_str, acquire_ydl(format_str))
+
+
+# Protocol name (API) -> pyatv enum / key credentials are stored under
+_PROTOCOL_MAP = {"airplay": Protocol.AirPlay, "companion": Protocol.Companion, "mrp": Protocol.MRP}
+_PROTOCOL_STORAGE_KEY = {"airplay": "AirPlay", "companion": "Companion", "mrp": "MRP"}
+# Play/stop scan only these (DMAP excluded: pyatv login_id None error on Apple TV 3rd gen)
+_SCAN_PROTOCOLS = frozenset(_PROTOCOL_MAP.values())
+
+
+def _protocol_names(atv) -> List[str]:
+    """Names of the modern protocols a scanned config offers, in _PROTOCOL_MAP order (one pass over its services)."""
+    present = {service.protocol for service in atv.services}
+    return [name for name, proto in _PROTOCOL_MAP.items() if proto in present]
+
+
+# Connected pyatv instances are kept this long after a play/stop so the next command skips scan + handshake
+_CONNECTION_TTL_SEC = 60.0
+# Least recently released connections are closed beyond this many
+_MAX_CONNECTIONS = 4
+# A cached connection failing with one of these went stale (Apple TV slept, socket closed): reconnect and retry once
+_STALE_CONNECTION_ERRORS = (ConnectionLostError, ConnectionFailedError, OperationTimeoutError, OSError)
+
+
+class _StaleConnection(Exception):
+    """A command failed on a reused connection; the caller retries once on a fresh one."""
+
+
+class _ConnectionListener(DeviceListener):
+    """Evicts a cached connection when the device closes or drops it."""
+
+    def __init__(self, on_gone):
+        self._on_gone = on_gone
+
+    def connection_lost(self, exception: Exception) -> None:
+        self._on_gone()
+
+    def connection_closed(self) -> None:
+        self._on_gone()
+
+
+# Abandoned pairings (PIN never submitted) are closed after this long; at most this many kept
+_PAIRING_SESSION_TTL_SEC = 300.0
+_MAX_PAIRING_SESSIONS = 16
+
+
+@dataclass(slots=True)
+class PairingSession:
+    """Pairing in progress: handler, the storage key (AirPlay/Companion/MRP) its credentials go under
+    and the device identifier seen at start, so finishing needs no rescan."""
+    pairing: PairingHandler
+    protocol_key: str
+    identifier: str
+    created_at: float = field(default_factory=time.monotonic)
+
+
+# AirPlay errors (lowercased) that mean "format rejected": retry with server-side remux/merge
+_RETRY_TOKENS = ("400", "rtsp", "bad request")
+# For HLS, a 500 can mean Apple TV accepted the URL but can't load the stream
+_HLS_500_TOKENS = ("500", "internal server error")
+
+# Fixed message templates for remux/merge streams the Apple TV never fetched or that failed to start
+_HLS_REMUX_FAIL_MSG = (
+    "HLS-поток не воспроизводится напрямую. Remux не удался: {err_detail}. "
+    "Убедитесь, что STREAM_BASE_URL ({base}) доступен с Apple TV (откройте в браузере с телефона в той же Wi‑Fi)."
+)
+_HLS_NOT_REQUESTED_MSG = (
+    " ВНИМАНИЕ: Apple TV ({address}) не запросил поток. Проверьте: 1) доступность {url} с Apple TV, "
+    "2) firewall (порт 8100), 3) правильность STREAM_BASE_URL."
+)
+_MERGE_NOT_REQUESTED_MSG = " ВНИМАНИЕ: Apple TV не запросил поток. Проверьте доступность URL с Apple TV: {url}"
+_LOG_NOT_REQUESTED = "[stream %s] Apple TV (%s) did not request stream - URL may not be accessible from Apple TV"
+_LOG_TROUBLESHOOT_URL = "[stream %s] Troubleshooting: 1) Check if %s is accessible from Apple TV network"
+_LOG_TROUBLESHOOT_FIREWALL = "[stream %s] Troubleshooting: 2) Check firewall on server (port 8100)"
+_LOG_TROUBLESHOOT_BASE_URL = "[stream %s] Troubleshooting: 3) Verify STREAM_BASE_URL matches server IP accessible from Apple TV"
+
+# YouTube page or resolved googlevideo URL; signed URLs run to ~2KB, so one scan instead of two
+_YOUTUBE_MEDIA_RE = re.compile(r"googlevideo\.com|youtube\.com")
+
+
+def _warn_if_prewarm_incomplete(task: "asyncio.Future[bool]") -> None:
+    if not task.cancelled() and task.exception() is None and not task.result():
+        logger.warning("HLS pre-warm incomplete, but proceeding anyway")
+
+
+def _playback_500_success(atv_name: str, url_to_play: str, context: str, merge_used: bool) -> Dict[str, Any]:
+    """Result for HTTP 500 on /playback-info (known pyatv issue): playback usually started, status just isn't returned."""
+    warning_msg = ""
+    # For remux streams, add warning about checking stream accessibility
+    if merge_used and "/stream/" in url_to_play:
+        warning_msg = f" Если воспроизведение не началось, проверьте доступность URL с Apple TV: {url_to_play}"
+    # For direct URLs (YouTube etc), add general note
+    elif not merge_used and _YOUTUBE_MEDIA_RE.search(url_to_play):
+        warning_msg = " Если воспроизведение не началось, проверьте подключение Apple TV к интернету и доступность YouTube."
+    return {
+        "status": "SUCCESS",
+        "message": f"Открыто на {atv_name}" + (f" ({context})" if context else "") + warning_msg,
+        "method": "airplay_remux" if merge_used else "airplay",
+        "merge_used": merge_used,
+    }
+
+
+class _StorageAdapter:
+    """Pairing storage: pyatv may pass a raw string for one protocol; we always store dict by protocol key."""
+
+    __slots__ = ("_db_storage", "_identifier", "_protocol_key")
+
+    def __init__(self, db_storage: DatabaseStorage, identifier: str, protocol_key: str):
+        self._db_storage = db_storage
+        self._identifier = identifier
+        self._protocol_key = protocol_key
+
+    def save(self, credentials: Any) -> None:
+        """Save credentials. Anything but a dict (str, Credentials) is stored as { protocol_key: credentials }."""
+        if type(credentials) is not dict:
+            credentials = {self._protocol_key: credentials}
+        self._db_storage.save(self._identifier, credentials)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        return self._db_storage.load(self._identifier)
+
+    def get_settings(self, identifier: str) -> Optional[Dict[str, Any]]:
+        return self._db_storage.load(identifier)
 
 
 class AppleTVService:
     """Service for Apple TV operations."""
+
+    __slots__ = (
+        "_pairing_sessions",
+        "_connections",
+        "_scan_cache",
+        "_inflight_scan",
+        "_ydl_executor",
+        "_resolve_cache",
+        "_resolve_inflight",
+        "_host_scan_cache",
+        "_host_scan_inflight",
+        "_device_locks",
+    )
     
     def __init__(self):
-        self._pairing_sessions: Dict[str, Union[PairingHandler, Tuple[PairingHandler, str]]] = {}
+        self._pairing_sessions: "OrderedDict[str, PairingSession]" = OrderedDict()
+        # (address, credentials_json) -> (config, connected instance, listener, expiry timer)
+        self._connections: Dict[Tuple[str, str], Tuple[Any, AppleTV, _ConnectionListener, asyncio.TimerHandle]] = {}
+        self._scan_cache: Optional[Tuple[float, List[Dict[str, Any]]]] = None
+        self._inflight_scan: Optional[asyncio.Future] = None
+        # Created on first resolve; see _get_ydl_executor
+        self._ydl_executor: Optional[ProcessPoolExecutor] = None
+        self._resolve_cache: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._resolve_inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._host_scan_cache: Dict[Tuple[str, frozenset], Tuple[float, list]] = {}
+        self._host_scan_inflight: Dict[Tuple[str, frozenset], asyncio.Future] = {}
+        # pyatv pairing/connection objects are not safe under concurrent use: one operation per device at a time.
+        # address -> [lock, holders + waiters]; removed when the count drops to 0 (see _device_lock)
+        self._device_locks: Dict[str, List[Any]] = {}
     
-    async def scan_devices(self, timeout: int = 5) -> List[Dict[str, Any]]:
-        """Scan for Apple TV devices on the local network."""
+    async def scan_devices(self, timeout: float = _SCAN_TIMEOUT_SEC) -> List[Dict[str, Any]]:
+        """Scan for Apple TV devices on the local network. Concurrent callers share one in-flight scan."""
+        inflight = self._inflight_scan
+        if inflight is None or inflight.done():
+            inflight = self._inflight_scan = asyncio.ensure_future(self._scan_devices(timeout))
+        # shield: a caller that goes away must not cancel the scan others are waiting on
+        return await asyncio.shield(inflight)
+
+    async def _scan_devices(self, timeout: float) -> List[Dict[str, Any]]:
         try:
             logger.info("Scanning for Apple TV devices...")
             # pyatv scan() returns a list when awaited
-            loop = asyncio.get_event_loop()
-            try:
-                # Use asyncio.wait_for to add timeout
-                atvs = await asyncio.wait_for(scan(loop=loop), timeout=timeout)
-            except asyncio.TimeoutError:
-                logger.info(f"Scan timeout after {timeout} seconds")
-                atvs = []  # Return empty list on timeout
+            loop = asyncio.get_running_loop()
+
+            async def guarded(**kwargs) -> list:
+                # pyatv returns what answered within `timeout`; wait_for is only a guard against a hung scan
+                try:
+                    return await asyncio.wait_for(scan(loop=loop, timeout=timeout, **kwargs), timeout=timeout + 1.0)
+                except asyncio.TimeoutError:
+                    logger.info("Scan timeout after %s seconds", timeout)
+                    return []  # Return empty list on timeout
+
+            # mDNS plus unicast probes of ARP neighbours, in parallel: same wall-clock budget as mDNS alone
+            arp_hosts = _arp_neighbours()
+            scans = [guarded()]
+            if arp_hosts:
+                scans.append(guarded(hosts=arp_hosts))
+            async with _SCAN_SEM:
+                results = await asyncio.gather(*scans, return_exceptions=True)
+            if all(isinstance(r, BaseException) for r in results):
+                raise results[0]
+            atvs = []
+            seen = set()
+            for result in results:
+                if isinstance(result, BaseException):
+                    logger.warning("Scan failed: %s", result)
+                    continue
+                for atv in result:
+                    key = (str(atv.address), str(atv.identifier))
+                    if key not in seen:
+                        seen.add(key)
+                        atvs.append(atv)
             
             devices = []
             for atv in atvs:
-                protocols = []
-                if atv.get_service(Protocol.AirPlay):
-                    protocols.append("airplay")
-                if atv.get_service(Protocol.Companion):
-                    protocols.append("companion")
-                if atv.get_service(Protocol.MRP):
-                    protocols.append("mrp")
+                protocols = _protocol_names(atv)
                 
                 # If no protocols found, might be Apple TV 1st generation
                 device_type = "modern"
                 if not protocols:
                     device_type = "legacy"
-                    logger.info(f"Device {atv.name} has no modern protocols - likely Apple TV 1st generation")
+                    logger.info("Device %s has no modern protocols - likely Apple TV 1st generation", atv.name)
                 
+                atv_address = str(atv.address)
                 device_info = {
-                    "device_id": f"{atv.address}_{atv.name}",
+                    "device_id": f"{atv_address}_{atv.name}",
                     "name": atv.name,
-                    "address": str(atv.address),
+                    "address": atv_address,
                     "protocols": protocols,
                     "identifier": str(atv.identifier) if hasattr(atv, 'identifier') else None,
                     "device_type": device_type,  # "modern" or "legacy"
                 }
                 devices.append(device_info)
-                logger.info(f"Found device: {device_info['name']} at {device_info['address']} (protocols: {protocols})")
+                logger.info("Found device: %s at %s (protocols: %s)", device_info["name"], device_info["address"], protocols)
             
+            self._scan_cache = (time.monotonic(), devices)
             return devices
         except Exception as e:
-            logger.error(f"Error scanning for devices: {e}", exc_info=True)
+            logger.error("Error scanning for devices: %s", e, exc_info=True)
             raise
     
+    async def scan_devices_cached(self, ttl: float = _SCAN_CACHE_TTL_SEC) -> List[Dict[str, Any]]:
+        """Return the last scan if younger than `ttl` seconds, else scan."""
+        cached = self._scan_cache
+        if cached and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+        return await self.scan_devices()
+    
+    async def _cached_scan(self, address: str, protocols: Optional[frozenset] = None) -> list:
+        """scan(hosts=[address]) with results reused for _HOST_SCAN_TTL_SEC. Empty results are not cached.
+        Concurrent callers for the same host/protocols share one in-flight scan; other hosts scan in parallel."""
+        key = (str(address), protocols or frozenset())
+        cached = self._host_scan_cache.get(key)
+        if cached and time.monotonic() - cached[0] < _HOST_SCAN_TTL_SEC:
+            return cached[1]
+        inflight = self._host_scan_inflight.get(key)
+        if inflight is None:
+            inflight = self._host_scan_inflight[key] = asyncio.ensure_future(self._scan_host(key))
+            inflight.add_done_callback(lambda _f: self._host_scan_inflight.pop(key, None))
+        # shield: a caller that goes away must not cancel the scan others are waiting on
+        return await asyncio.shield(inflight)
+
+    async def _scan_host(self, key: Tuple[str, frozenset]) -> list:
+        address, protocols = key
+        loop = asyncio.get_running_loop()
+        scan_kwargs: Dict[str, Any] = {"hosts": [address], "timeout": _HOST_SCAN_TIMEOUT_SEC}
+        if protocols:
+            scan_kwargs["protocol"] = set(protocols)
+        try:
+            # Guard: an unreachable host must not hold callers past the scan budget
+            async with _SCAN_SEM:
+                atvs = await asyncio.wait_for(scan(loop=loop, **scan_kwargs), timeout=_HOST_SCAN_TIMEOUT_SEC + 1.0)
+        except asyncio.TimeoutError:
+            logger.info("Scan of %s timed out", address)
+            atvs = []
+        if atvs:
+            self._host_scan_cache[key] = (time.monotonic(), atvs)
+        return atvs
+
+    @asynccontextmanager
+    async def _device_lock(self, address: str):
+        """Hold the per-device lock. Entries only live while someone holds or waits for them,
+        so addresses seen once (typos, one-off manual adds) don't accumulate."""
+        key = str(address)
+        entry = self._device_locks.get(key)
+        if entry is None:
+            entry = self._device_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._device_locks[key]
+
+    def _invalidate_scan(self, address: str) -> None:
+        """Drop cached scans for a host (e.g. after connect failed: address/port may have changed)."""
+        address = str(address)
+        for key in [k for k in self._host_scan_cache if k[0] == address]:
+            del self._host_scan_cache[key]
+    
+    def _take_connection(self, key: Tuple[str, str]) -> Optional[Tuple[Any, AppleTV]]:
+        """Check out a cached (config, connected instance); the caller owns it until _release_connection."""
+        entry = self._connections.pop(key, None)
+        if entry is None:
+            return None
+        atv, atv_instance, _, timer = entry
+        timer.cancel()
+        return atv, atv_instance
+
+    def _release_connection(self, key: Tuple[str, str], atv: Any, atv_instance: AppleTV) -> None:
+        """Keep a healthy connection for _CONNECTION_TTL_SEC; closed when it expires or the device drops it."""
+        previous = self._connections.pop(key, None)
+        if previous is not None:
+            previous[3].cancel()
+            previous[1].close()
+
+        def evict():
+            entry = self._connections.get(key)
+            if entry is not None and entry[1] is atv_instance:
+                del self._connections[key]
+                entry[3].cancel()
+                atv_instance.close()
+
+        listener = _ConnectionListener(evict)
+        atv_instance.listener = listener  # pyatv holds listeners weakly; the entry keeps it alive
+        timer = asyncio.get_running_loop().call_later(_CONNECTION_TTL_SEC, evict)
+        self._connections[key] = (atv, atv_instance, listener, timer)
+        while len(self._connections) > _MAX_CONNECTIONS:
+            oldest = self._connections.pop(next(iter(self._connections)))
+            oldest[3].cancel()
+            oldest[1].close()
+
+    async def shutdown(self) -> None:
+        """Application shutdown: close cached connections (waiting for pyatv to finish closing them)
+        and stop yt-dlp workers."""
+        close_tasks = self.close_connections()
+        executor, self._ydl_executor = self._ydl_executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if close_tasks:
+            await asyncio.gather(*close_tasks, return_exceptions=True)
+
+    def close_connections(self) -> Set[asyncio.Task]:
+        """Close every cached connection. Returns the tasks pyatv started to tear them down."""
+        connections = list(self._connections.values())
+        self._connections.clear()
+        close_tasks: Set[asyncio.Task] = set()
+        for _, atv_instance, _, timer in connections:
+            timer.cancel()
+            close_tasks |= atv_instance.close() or set()
+        return close_tasks
+    
     async def start_pairing(
         self, 
         device_id: str, 
@@ -89,23 +543,15 @@ class AppleTVService:
     ) -> Dict[str, Any]:
         """Start pairing process with an Apple TV."""
         try:
-            logger.info(f"Starting pairing for {device_id} with protocol {protocol}")
-            
-            # Map protocol string to Protocol enum
-            protocol_map = {
-                "airplay": Protocol.AirPlay,
-                "companion": Protocol.Companion,
-                "mrp": Protocol.MRP,
-            }
+            logger.info("Starting pairing for %s with protocol %s", device_id, protocol)
             
-            if protocol not in protocol_map:
+            target_protocol = _PROTOCOL_MAP.get(protocol)
+            if target_protocol is None:
                 raise ValueError(f"Unsupported protocol: {protocol}")
             
-            target_protocol = protocol_map[protocol]
-            
-            # Scan for the specific device
-            loop = asyncio.get_event_loop()
-            atvs = await scan(loop=loop, hosts=[str(address)])
+            # Same protocol set as play/stop: pyatv derives atv.identifier from the services found, and
+            # credentials must be stored under the identifier _apply_credentials will look up
+            atvs = await self._cached_scan(address, _SCAN_PROTOCOLS)
             # scan() returns a list, take first result if available
             if not atvs:
                 raise ValueError(f"Device not found at {address}")
@@ -116,68 +562,55 @@ class AppleTVService:
                 raise ValueError(f"Protocol {protocol} not supported by device")
             
             # Map protocol to storage key (AirPlay, Companion, MRP) so we store two separate credentials
-            protocol_storage_key = {"airplay": "AirPlay", "companion": "Companion", "mrp": "MRP"}.get(protocol, "AirPlay")
+            protocol_storage_key = _PROTOCOL_STORAGE_KEY.get(protocol, "AirPlay")
             
             # Create storage from existing credentials if available
             db_storage = DatabaseStorage(credentials_json)
             device_identifier = str(atv.identifier)
             
-            # Storage adapter: pyatv may pass a raw string for one protocol; we always store dict by protocol key
-            class StorageAdapter:
-                def __init__(self, db_storage: DatabaseStorage, identifier: str, protocol_key: str):
-                    self._db_storage = db_storage
-                    self._identifier = identifier
-                    self._protocol_key = protocol_key
-                
-                def save(self, credentials: Any) -> None:
-                    """Save credentials. If pyatv passes a string, store as { protocol_key: credentials }."""
-                    if isinstance(credentials, str):
-                        credentials = {self._protocol_key: credentials}
-                    elif not isinstance(credentials, dict):
-                        credentials = {self._protocol_key: credentials}
-                    self._db_storage.save(self._identifier, credentials)
-                
-                def load(self) -> Optional[Dict[str, Any]]:
-                    return self._db_storage.load(self._identifier)
-                
-                def get_settings(self, identifier: str) -> Optional[Dict[str, Any]]:
-                    return self._db_storage.load(identifier)
-            
-            storage_adapter = StorageAdapter(db_storage, device_identifier, protocol_storage_key)
-            
-            # Start pairing - pyatv pair() signature may vary by version
-            loop = asyncio.get_event_loop()
-            try:
-                pairing = await pair(atv, target_protocol, loop=loop, storage=storage_adapter)
-            except TypeError:
-                pairing = await pair(atv, target_protocol, loop=loop)
+            storage_adapter = _StorageAdapter(db_storage, device_identifier, protocol_storage_key)
             
-            # Store (pairing, protocol_key) so submit_pin can save under the right key
-            self._pairing_sessions[device_id] = (pairing, protocol_storage_key)
+            async with self._device_lock(address):
+                # Start pairing - pyatv pair() signature may vary by version
+                loop = asyncio.get_running_loop()
+                try:
+                    pairing = await pair(atv, target_protocol, loop=loop, storage=storage_adapter)
+                except TypeError:
+                    pairing = await pair(atv, target_protocol, loop=loop)
             
-            # Start the pairing process (required so Apple TV shows PIN)
-            await pairing.begin()
+                # Keep protocol_key so submit_pin can save under the right key
+                await self._close_pairing(self._pairing_sessions.pop(device_id, None))
+                await self._prune_pairing_sessions()
+                session = self._pairing_sessions[device_id] = PairingSession(pairing, protocol_storage_key, device_identifier)
             
-            # Check pairing requirement
-            if pairing.device_provides_pin:
-                return {
-                    "status": "PIN_REQUIRED",
-                    "message": "Enter PIN shown on Apple TV",
-                }
-            elif pairing.requires_credentials:
-                return {
-                    "status": "CREDENTIALS_REQUIRED",
-                    "message": "Credentials required",
-                }
-            else:
-                # Pairing completed automatically
-                await pairing.finish()
+                try:
+                    # Start the pairing process (required so Apple TV shows PIN)
+                    await pairing.begin()
+                
+                    # Check pairing requirement
+                    if pairing.device_provides_pin:
+                        return {
+                            "status": "PIN_REQUIRED",
+                            "message": "Enter PIN shown on Apple TV",
+                        }
+                    elif pairing.requires_credentials:
+                        return {
+                            "status": "CREDENTIALS_REQUIRED",
+                            "message": "Credentials required",
+                        }
+                    # Pairing completed automatically
+                    await pairing.finish()
+                except Exception:
+                    # Nothing will submit a PIN for a pairing that failed to start: release its connection now
+                    await self._discard_pairing(device_id, session)
+                    raise
+                await self._discard_pairing(device_id, session)
                 return {
                     "status": "COMPLETED",
                     "message": "Pairing completed",
                 }
         except Exception as e:
-            logger.error(f"Error starting pairing: {e}", exc_info=True)
+            logger.error("Error starting pairing: %s", e, exc_info=True)
             raise
     
     async def submit_pin(
@@ -189,82 +622,95 @@ class AppleTVService:
         credentials_json: Optional[str] = None
     ) -> Dict[str, Any]:
         """Submit PIN for pairing."""
-        try:
-            logger.info(f"Submitting PIN for {device_id}")
+        async with self._device_lock(address):
+            try:
+                logger.info("Submitting PIN for %s", device_id)
             
-            session = self._pairing_sessions.get(device_id)
-            if not session:
-                raise ValueError("No active pairing session found")
-            pairing = session[0] if isinstance(session, tuple) else session
-            protocol_storage_key = session[1] if isinstance(session, tuple) and len(session) > 1 else "AirPlay"
+                session = self._pairing_sessions.get(device_id)
+                if not session:
+                    raise ValueError("No active pairing session found")
+                pairing = session.pairing
+                protocol_storage_key = session.protocol_key
             
-            pairing.pin(pin)
-            await pairing.finish()
+                pairing.pin(pin)
+                await pairing.finish()
             
-            db_storage = DatabaseStorage(credentials_json)
-            loop = asyncio.get_event_loop()
-            atvs = await scan(loop=loop, hosts=[str(address)])
-            if atvs:
-                device_identifier = str(atvs[0].identifier)
+                # Unchanged credentials go back as the same string: parse + re-serialize only when something was added
+                updated_json = credentials_json or "{}"
                 # Save under protocol key so we have two separate codes for AirPlay and Companion
                 try:
                     if hasattr(pairing, 'service') and hasattr(pairing.service, 'credentials'):
                         creds = pairing.service.credentials
                         if creds:
-                            db_storage.save(device_identifier, {protocol_storage_key: creds})
+                            db_storage = DatabaseStorage(credentials_json)
+                            db_storage.save(session.identifier, {protocol_storage_key: creds})
+                            updated_json = db_storage.to_json()
                 except Exception:
                     pass
-                
-                del self._pairing_sessions[device_id]
-                
+            
+                await self._close_pairing(self._pairing_sessions.pop(device_id, None))
+            
                 return {
                     "status": "COMPLETED",
                     "message": "Pairing completed successfully",
-                    "credentials": db_storage.to_json(),  # Return updated credentials JSON
+                    "credentials": updated_json,  # Return updated credentials JSON
                 }
-            else:
-                raise ValueError("Device not found after pairing")
+            except Exception as e:
+                logger.error("Error submitting PIN: %s", e, exc_info=True)
+                await self._close_pairing(self._pairing_sessions.pop(device_id, None))
+                raise
+    
+    @staticmethod
+    async def _close_pairing(session: Optional[PairingSession]) -> None:
+        if session is None:
+            return
+        try:
+            await session.pairing.close()
         except Exception as e:
-            logger.error(f"Error submitting PIN: {e}", exc_info=True)
-            if device_id in self._pairing_sessions:
-                del self._pairing_sessions[device_id]
-            raise
+            logger.debug("Closing pairing failed: %s", e)
+    
+    async def _discard_pairing(self, device_id: str, session: PairingSession) -> None:
+        """Remove and close `session` unless a newer pairing for the device has replaced it."""
+        if self._pairing_sessions.get(device_id) is session:
+            del self._pairing_sessions[device_id]
+        await self._close_pairing(session)
+    
+    async def _prune_pairing_sessions(self) -> None:
+        """Close sessions older than _PAIRING_SESSION_TTL_SEC and the oldest beyond _MAX_PAIRING_SESSIONS."""
+        sessions = self._pairing_sessions
+        now = time.monotonic()
+        while sessions:
+            device_id, oldest = next(iter(sessions.items()))
+            if now - oldest.created_at < _PAIRING_SESSION_TTL_SEC and len(sessions) < _MAX_PAIRING_SESSIONS:
+                break
+            del sessions[device_id]
+            await self._close_pairing(oldest)
     
     @staticmethod
     def _format_for_quality(quality: str) -> str:
         """yt-dlp format string. YouTube 720p+ is usually DASH (video-only); we take best single URL.
         Combined (video+audio) is often only 360p. For 720p/1080p we use bestvideo to get resolution (no audio)."""
-        q = (quality or "auto").lower().strip()
-        if q == "auto" or not q:
-            # Prefer best combined format (video+audio) for AirPlay RTSP compatibility
-            # DASH-only streams (video-only or audio-only) cause RTSP SETUP 400 errors
-            return "best[ext=mp4]/best"
-        if q == "1080p":
-            # YouTube 1080p = DASH only; take bestvideo for resolution (video-only, no audio)
-            return "bestvideo[height<=1080][ext=mp4]/bestvideo[height<=1080]/best[height<=1080]/best"
-        if q == "720p":
-            return "bestvideo[height<=720][ext=mp4]/bestvideo[height<=720]/best[height<=720]/best"
-        if q == "480p":
-            return "best[height<=480][ext=mp4]/best[height<=480]/best"
-        if q == "360p":
-            return "best[height<=360][ext=mp4]/best[height<=360]/best"
-        return "best[ext=mp4]/best[ext=m4a]/best"
+        return _FORMAT_TABLE.get((quality or "auto").lower().strip() or "auto", _FORMAT_DEFAULT)
 
     @staticmethod
     def _resolve_stream_url_blocking(url: str, quality: str = "auto") -> Optional[Dict[str, Any]]:
         """Resolve YouTube/page URL to direct stream URL; return dict with url and optional height/quality info."""
-        if not HAS_YT_DLP or not yt_dlp:
+        if not HAS_YT_DLP:
             return None
         try:
             format_str = AppleTVService._format_for_quality(quality)
-            opts = {
-                "format": format_str,
-                "skip_download": True,
-                "quiet": True,
-                "no_warnings": True,
-            }
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                info = ydl.extract_info(url, download=False)
+            tiers = _FORMAT_TIERS.get((quality or "auto").lower().strip() or "auto", _FORMAT_TIERS_DEFAULT)
+            # Checked out for this call only: one YoutubeDL is not used by two threads at once
+            ydl = acquire_ydl(format_str)
+            try:
+                # Skip yt-dlp's format sorting/selection pipeline: pick the one URL we need ourselves
+                info = ydl.extract_info(url, download=False, process=False)
+                chosen = _pick_format(info, tiers) if info else None
+                if info and chosen is None:
+                    chosen = ydl.process_ie_result(info, download=False)
+                info = chosen
+            finally:
+                release_ydl(format_str, ydl)
             if not info:
                 return None
             result_url = info.get("url")
@@ -296,73 +742,120 @@ class AppleTVService:
                 quality_label = None
             return {"url": result_url, "quality_label": quality_label}
         except Exception as e:
-            logger.warning(f"Could not resolve stream URL: {e}")
+            logger.warning("Could not resolve stream URL: %s", e)
             return None
 
+    async def warmup(self) -> None:
+        """Start the yt-dlp workers and build their YoutubeDL instances (app startup, in the background)."""
+        if not HAS_YT_DLP:
+            return
+        loop = asyncio.get_running_loop()
+        executor = self._get_ydl_executor()
+        try:
+            await asyncio.gather(*(loop.run_in_executor(executor, _warm_ydl) for _ in range(_YDL_WORKERS)))
+        except BrokenProcessPool:
+            logger.warning("yt-dlp worker pool broke during warmup; restarting on next resolve")
+            self._drop_ydl_executor(executor)
+        except Exception as e:
+            logger.warning("yt-dlp warmup failed: %s", e)
+
+    def _drop_ydl_executor(self, executor: ProcessPoolExecutor) -> None:
+        """Discard a broken worker pool (a worker died: OOM, crash) so the next resolve starts a fresh one."""
+        executor.shutdown(wait=False, cancel_futures=True)
+        if self._ydl_executor is executor:
+            self._ydl_executor = None
+
+    def _get_ydl_executor(self) -> ProcessPoolExecutor:
+        """yt-dlp's signature decipher is pure Python: resolve in worker processes so concurrent plays
+        don't contend for the GIL with the event loop. spawn, not fork: the server process runs threads."""
+        executor = self._ydl_executor
+        if executor is None:
+            executor = self._ydl_executor = ProcessPoolExecutor(
+                max_workers=_YDL_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return executor
+
     async def _resolve_stream_url(self, url: str, quality: str = "auto") -> Optional[Dict[str, Any]]:
-        """Resolve YouTube/page URL to direct stream URL (non-blocking). Returns dict with url and optional quality_label."""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._resolve_stream_url_blocking, url, quality)
+        """Resolve YouTube/page URL to direct stream URL (non-blocking). Returns dict with url and optional quality_label.
+        Results are reused until shortly before the stream URL's own expiry (at most _RESOLVE_CACHE_TTL_SEC);
+        concurrent callers for the same (url, quality) share one yt-dlp run."""
+        key = (url, (quality or "auto").lower().strip())
+        cached = self._resolve_cache.get(key)
+        if cached:
+            if cached[0] > time.time():
+                self._resolve_cache.move_to_end(key)
+                return cached[1]
+            del self._resolve_cache[key]
+        inflight = self._resolve_inflight.get(key)
+        if inflight is None:
+            inflight = self._resolve_inflight[key] = asyncio.ensure_future(self._resolve_uncached(key, url, quality))
+            inflight.add_done_callback(lambda _f: self._resolve_inflight.pop(key, None))
+        # shield: play_url cancels its speculative resolve, which must not cancel it for other callers
+        return await asyncio.shield(inflight)
+
+    async def _resolve_uncached(self, key: Tuple[str, str], url: str, quality: str) -> Optional[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        executor = self._get_ydl_executor()
+        try:
+            resolved = await loop.run_in_executor(executor, self._resolve_stream_url_blocking, url, quality)
+        except BrokenProcessPool:
+            logger.warning("yt-dlp worker pool broke; restarting on next resolve")
+            self._drop_ydl_executor(executor)
+            return None
+        if resolved:
+            now = time.time()
+            expires_at = now + _RESOLVE_CACHE_TTL_SEC
+            m = _EXPIRE_RE.search(resolved["url"])
+            if m:
+                expires_at = min(expires_at, int(m.group(1)) - 60)
+            if expires_at > now:
+                self._resolve_cache[key] = (expires_at, resolved)
+                if len(self._resolve_cache) > _RESOLVE_CACHE_MAX:
+                    self._resolve_cache.popitem(last=False)
+        return resolved
+
+    @staticmethod
+    def _classify_url(url: Optional[str]) -> int:
+        """One pass over the URL: bit flags _URL_DEEP_LINK | _URL_HLS | _URL_DIRECT_MEDIA."""
+        if not url or not isinstance(url, str):
+            return 0
+        flags = 0
+        if url.startswith('http') or _DEEP_LINK_RE.search(url):
+            flags |= _URL_DEEP_LINK
+        if _HLS_RE.search(url):
+            flags |= _URL_HLS
+        if _DIRECT_MEDIA_RE.search(url.split("?", 1)[0]):
+            flags |= _URL_DIRECT_MEDIA
+        return flags
 
     def _is_direct_media_url(self, url: Optional[str]) -> bool:
         """Check if URL looks like direct media (stream), not a web/page link."""
-        if not url or not isinstance(url, str):
-            return False
-        url_lower = url.lower().split("?")[0]
-        direct_extensions = (".mp4", ".m4v", ".m3u8", ".ts", ".mov", ".webm", ".mkv")
-        if any(url_lower.endswith(ext) or ext in url_lower for ext in direct_extensions):
-            return True
-        # Common streaming path patterns
-        if "/stream/" in url_lower or "/video/" in url_lower or "/hls/" in url_lower:
-            return True
-        return False
+        return bool(self._classify_url(url) & _URL_DIRECT_MEDIA)
 
     def _is_hls_url(self, url: Optional[str]) -> bool:
         """Check if URL is HLS (.m3u8) for server-side remux to MP4."""
-        if not url or not isinstance(url, str):
-            return False
-        return ".m3u8" in url.lower()
+        return bool(self._classify_url(url) & _URL_HLS)
 
     def _is_deep_link(self, url: Optional[str]) -> bool:
         """Check if URL is a deep link (app link) vs media URL."""
-        if not url or not isinstance(url, str):
-            return False
-        deep_link_patterns = [
-            'tv.apple.com',
-            'disneyplus.com',
-            'netflix.com',
-            'hbomax.com',
-            'hulu.com',
-            'youtube.com',
-            'youtu.be',
-            'play.hbomax.com',
-            'www.disneyplus.com',
-            'www.netflix.com',
-        ]
-        url_lower = url.lower()
-        return any(pattern in url_lower for pattern in deep_link_patterns) or url.startswith('http')
+        return bool(self._classify_url(url) & _URL_DEEP_LINK)
 
     @staticmethod
     def _youtube_deep_link_url(url: str) -> Optional[str]:
         """Convert YouTube page URL to youtube:// deep link for Apple TV (plays in YouTube app, no conversion).
         See https://www.home-assistant.io/integrations/apple_tv/ — YouTube: youtube://www.youtube.com/watch?v=VIDEO_ID"""
-        if not url or "youtube.com" not in url.lower() and "youtu.be" not in url.lower():
+        if not url:
+            return None
+        try:
+            parts = urlsplit(url)
+            host = parts.hostname or ""
+        except ValueError:
             return None
         video_id = None
-        if "youtu.be/" in url.lower():
-            try:
-                from urllib.parse import urlparse
-                path = urlparse(url).path.strip("/")
-                video_id = path.split("?")[0].split("/")[0] if path else None
-            except Exception:
-                pass
-        if not video_id and "watch?v=" in url.lower():
-            try:
-                from urllib.parse import urlparse, parse_qs
-                parsed = urlparse(url)
-                video_id = (parse_qs(parsed.query).get("v") or [None])[0]
-            except Exception:
-                pass
+        if host == "youtu.be":
+            video_id = parts.path.strip("/").split("/")[0] or None
+        elif _is_youtube_host(host) and parts.path.rstrip("/") == "/watch":
+            video_id = (parse_qs(parts.query).get("v") or [None])[0]
         if video_id:
             return f"youtube://www.youtube.com/watch?v={video_id}"
         return None
@@ -372,12 +865,7 @@ class AppleTVService:
         """Build x-callback-url style play/open URL (VidHub/Infuse technology)."""
         if not url or not scheme or not path:
             return None
-        try:
-            from urllib.parse import quote
-            encoded = quote(url, safe="")
-            return f"{scheme}://x-callback-url/{path}?url={encoded}"
-        except Exception:
-            return None
+        return f"{scheme}://x-callback-url/{path}?url={quote(url, safe='')}"
 
     @staticmethod
     def _vidhub_deep_link_url(url: str) -> Optional[str]:
@@ -402,98 +890,66 @@ class AppleTVService:
         quality: str = "auto",
     ) -> Dict[str, Any]:
         """Play a URL on Apple TV using AirPlay or launch deep link via Apps."""
+        async with self._device_lock(address):
+            try:
+                return await self._play_url(url, device_id, address, credentials_json, quality, True)
+            except _StaleConnection as e:
+                logger.info("Cached connection to %s went stale (%s), reconnecting", address, e.__cause__)
+                return await self._play_url(url, device_id, address, credentials_json, quality, False)
+
+    async def _play_url(
+        self,
+        url: str,
+        device_id: str,
+        address: str,
+        credentials_json: Optional[str],
+        quality: str,
+        reuse_connection: bool,
+    ) -> Dict[str, Any]:
+        reused = False
         try:
             if not url or not isinstance(url, str) or not url.strip():
                 raise ValueError("URL is required and must be a non-empty string")
             url = url.strip()
-            logger.info(f"Playing/Launching URL {url} on device {device_id}")
+            logger.info("Playing/Launching URL %s on device %s", url, device_id)
             
-            # Create storage from credentials
-            storage = DatabaseStorage(credentials_json)
+            # Scan + connect (or reuse a recent connection) in the background; URL checks don't need the device
+            acquire_task = asyncio.ensure_future(self._acquire_atv(address, credentials_json, reuse_connection))
             
-            # Scan for device (exclude DMAP to avoid pyatv login_id None error on Apple TV 3rd gen)
-            loop = asyncio.get_event_loop()
-            atvs = await scan(
-                loop=loop,
-                hosts=[str(address)],
-                protocol={Protocol.AirPlay, Protocol.Companion, Protocol.MRP},
+            # Check if URL is a deep link (app link) or media URL
+            url_class = self._classify_url(url)
+            is_deep_link = bool(url_class & _URL_DEEP_LINK)
+            is_direct_media = bool(url_class & _URL_DIRECT_MEDIA)
+            is_hls = bool(url_class & _URL_HLS)
+            is_youtube = _is_youtube_host(_url_host(url))
+            youtube_link = self._youtube_deep_link_url(url) if is_youtube else None
+            # Page links (YouTube etc.) usually end up resolved by yt-dlp for AirPlay: overlap it with scan + connect
+            resolve_task = (
+                asyncio.ensure_future(self._resolve_stream_url(url, quality))
+                if HAS_YT_DLP and is_deep_link and not is_direct_media else None
             )
-            if not atvs:
-                raise ValueError(f"Device not found at {address}")
-            
-            atv = atvs[0]
             
-            # Set credentials on config before connecting
-            device_identifier = str(atv.identifier) if hasattr(atv, 'identifier') else str(atv.address)
-            stored_creds = storage.load(device_identifier)
-            
-            logger.info(f"Loading credentials for device {device_identifier}, found: {stored_creds is not None}")
-            
-            if stored_creds:
-                # Apply credentials to config services
-                try:
-                    creds_dict = stored_creds if isinstance(stored_creds, dict) else {}
-                    
-                    # Set AirPlay credentials
-                    airplay_service = atv.get_service(Protocol.AirPlay)
-                    if airplay_service:
-                        airplay_creds = None
-                        if 'airplay' in creds_dict:
-                            airplay_creds = creds_dict['airplay']
-                        elif 'AirPlay' in creds_dict:
-                            airplay_creds = creds_dict['AirPlay']
-                        elif 'credentials' in creds_dict:
-                            airplay_creds = creds_dict['credentials']
-                        
-                        if airplay_creds:
-                            if isinstance(airplay_creds, str):
-                                airplay_service.credentials = airplay_creds
-                            elif isinstance(airplay_creds, dict):
-                                airplay_service.credentials = airplay_creds.get('credentials') or airplay_creds
-                            else:
-                                airplay_service.credentials = airplay_creds
-                            logger.info(f"Set AirPlay credentials for {device_identifier}")
-                    
-                    # Set Companion/MRP credentials for app launching
-                    companion_service = atv.get_service(Protocol.Companion)
-                    if companion_service:
-                        companion_creds = creds_dict.get('companion') or creds_dict.get('Companion')
-                        if companion_creds:
-                            if isinstance(companion_creds, str):
-                                companion_service.credentials = companion_creds
-                            elif isinstance(companion_creds, dict):
-                                companion_service.credentials = companion_creds.get('credentials') or companion_creds
-                            else:
-                                companion_service.credentials = companion_creds
-                            logger.info(f"Set Companion credentials for {device_identifier}")
-                except Exception as e:
-                    logger.warning(f"Could not set credentials from storage: {e}", exc_info=True)
+            try:
+                atv, atv_instance, has_airplay_creds, reused = await acquire_task
+            except BaseException:
+                if resolve_task is not None:
+                    resolve_task.cancel()
+                raise
+            conn_key = (str(address), credentials_json or "")
+            atv_address = str(atv.address)
+            atv_name = atv.name
             
-            # Check if we have AirPlay credentials (required for stream.play_url / YouTube playback)
-            airplay_service = atv.get_service(Protocol.AirPlay)
-            has_airplay_creds = False
-            if stored_creds and isinstance(stored_creds, dict):
-                creds_dict = stored_creds
-                ap = creds_dict.get("airplay") or creds_dict.get("AirPlay") or creds_dict.get("credentials")
-                has_airplay_creds = bool(ap)
-            if airplay_service and not has_airplay_creds:
+            # AirPlay credentials are required for stream.play_url / YouTube playback
+            if not has_airplay_creds and atv.get_service(Protocol.AirPlay):
                 logger.warning("AirPlay credentials missing - playback will likely fail with 'not authenticated'")
             
-            # Connect to device
-            atv_instance = await connect(atv, loop=loop)
+            # Check available protocols
+            available_protocols = _protocol_names(atv)
+            
+            logger.info("Available protocols: %s", available_protocols)
             
+            keep_connection = True
             try:
-                # Check available protocols
-                available_protocols = []
-                if atv.get_service(Protocol.AirPlay):
-                    available_protocols.append("AirPlay")
-                if atv.get_service(Protocol.Companion):
-                    available_protocols.append("Companion")
-                if atv.get_service(Protocol.MRP):
-                    available_protocols.append("MRP")
-                
-                logger.info(f"Available protocols: {available_protocols}")
-                
                 # Apple TV 1st generation doesn't support AirPlay/Companion/MRP
                 # For older devices, we can only provide basic info
                 if not available_protocols:
@@ -501,15 +957,11 @@ class AppleTVService:
                     return {
                         "status": "LIMITED_SUPPORT",
                         "message": f"Apple TV 1st generation detected. Direct URL playback not supported. Please use iTunes sync or manual playback.",
-                        "device_name": atv.name,
-                        "address": str(atv.address),
+                        "device_name": atv_name,
+                        "address": atv_address,
                         "note": "Apple TV 1st generation does not support AirPlay or modern protocols",
                     }
                 
-                # Check if URL is a deep link (app link) or media URL
-                is_deep_link = self._is_deep_link(url)
-                is_direct_media = self._is_direct_media_url(url)
-                is_hls = self._is_hls_url(url)
                 has_apps = getattr(atv_instance, "apps", None) is not None
 
                 # Try deep links: YouTube → youtube://, HLS → VidHub then Infuse (x-callback-url), other apps
@@ -520,8 +972,8 @@ class AppleTVService:
                         launch_url = None
                         app_name = None
                         # YouTube: youtube:// scheme
-                        if "youtube.com" in url.lower() or "youtu.be" in url.lower():
-                            launch_url = self._youtube_deep_link_url(url)
+                        if is_youtube:
+                            launch_url = youtube_link
                             app_name = "YouTube"
                         # HLS / direct HTTP(S): try VidHub then Infuse (same tech: x-callback-url + AVPlayer)
                         elif is_hls or is_direct_media:
@@ -532,15 +984,15 @@ class AppleTVService:
                                 if not candidate_url:
                                     continue
                                 try:
-                                    logger.info(f"Launching deep link ({name}): {candidate_url[:80]}...")
+                                    logger.info("Launching deep link (%s): %.80s...", name, candidate_url)
                                     await apps.launch_app(candidate_url)
                                     return {
                                         "status": "SUCCESS",
-                                        "message": f"Открыто на {atv.name} (приложение {name})",
+                                        "message": f"Открыто на {atv_name} (приложение {name})",
                                         "method": "deep_link",
                                     }
                                 except Exception as e:
-                                    logger.warning(f"Deep link {name} failed: {e}")
+                                    logger.warning("Deep link %s failed: %s", name, e)
                             app_deep_link_failed = True
                             if is_hls:
                                 logger.info("VidHub/Infuse not available for HLS, will use AirPlay with remux")
@@ -548,15 +1000,15 @@ class AppleTVService:
                         elif is_deep_link:
                             launch_url = url
                             try:
-                                logger.info(f"Launching deep link (app): {launch_url[:80]}...")
+                                logger.info("Launching deep link (app): %.80s...", launch_url)
                                 await apps.launch_app(launch_url)
                                 return {
                                     "status": "SUCCESS",
-                                    "message": f"Открыто на {atv.name}",
+                                    "message": f"Открыто на {atv_name}",
                                     "method": "deep_link",
                                 }
                             except Exception as e:
-                                logger.warning(f"Failed to launch deep link: {e}")
+                                logger.warning("Failed to launch deep link: %s", e)
                     else:
                         app_deep_link_failed = is_hls
                 vidhub_failed = app_deep_link_failed
@@ -568,14 +1020,15 @@ class AppleTVService:
                         return {
                             "status": "NEED_AIRPLAY_PAIRING",
                             "message": "Для воспроизведения видео нужна сопряжение по AirPlay. Откройте настройки устройства, выберите этот Apple TV и выполните сопряжение по протоколу «AirPlay» (не только Companion).",
-                            "device_name": atv.name,
+                            "device_name": atv_name,
                         }
-                    self._last_merge_used = False
+                    merge_used = False  # per call: plays on different devices run concurrently
                     resolved_quality = None
                     base = (os.environ.get("STREAM_BASE_URL") or "http://localhost:8000").rstrip("/")
                     # Step 1: build URL the simple way (like HA — pass URL or single resolved stream)
                     # For HLS: if VidHub failed, skip raw playback and go straight to remux
-                    skip_raw_hls = vidhub_failed and is_direct_media and self._is_hls_url(url)
+                    hls_direct = is_direct_media and is_hls
+                    skip_raw_hls = vidhub_failed and hls_direct
                     if is_direct_media and not skip_raw_hls:
                         play_url_final = url
                     elif skip_raw_hls:
@@ -583,18 +1036,18 @@ class AppleTVService:
                         play_url_final = None
                     else:
                         # Page link (YouTube etc.): resolve to single stream URL
-                        resolved = await self._resolve_stream_url(url, quality)
+                        resolved = await resolve_task if resolve_task is not None else await self._resolve_stream_url(url, quality)
                         if not resolved:
                             return {
                                 "status": "UNSUPPORTED_URL",
                                 "message": "Не удалось получить прямую ссылку на видео. Поддерживаются YouTube и похожие сайты (нужен yt-dlp). Для Netflix/приложений используйте Apple TV 4-го поколения (tvOS) или вставьте прямую ссылку (.mp4, .m3u8).",
-                                "device_name": atv.name,
+                                "device_name": atv_name,
                             }
                         play_url_final = resolved["url"]
                         resolved_quality = resolved.get("quality_label")
                     
                     # Helper to handle HTTP 500 on /playback-info (known pyatv issue)
-                    async def play_url_with_500_handling(url_to_play: str, context: str = "") -> Optional[Dict[str, Any]]:
+                    async def play_url_with_500_handling(url_to_play: str, context: str = "", merge_used: bool = False) -> Optional[Dict[str, Any]]:
                         """Play URL via AirPlay, handling HTTP 500 on /playback-info as success.
                         Note: HTTP 500 usually means playback started but Apple TV doesn't return status.
                         If playback doesn't start, check that Apple TV can access the URL."""
@@ -602,44 +1055,21 @@ class AppleTVService:
                             await stream.play_url(url_to_play)
                             return None  # Success, no error
                         except HttpError as err:
-                            if err.status_code == 500:
-                                logger.info(f"HTTP 500 from Apple TV (known pyatv issue with /playback-info) - playback likely started{(' - ' + context) if context else ''}, treating as success")
-                                # For remux streams, add warning about checking stream accessibility
-                                warning_msg = ""
-                                if self._last_merge_used and "/stream/" in url_to_play:
-                                    warning_msg = f" Если воспроизведение не началось, проверьте доступность URL с Apple TV: {url_to_play}"
-                                # For direct URLs (YouTube etc), add general note
-                                elif not self._last_merge_used and ("googlevideo.com" in url_to_play or "youtube.com" in url_to_play):
-                                    warning_msg = " Если воспроизведение не началось, проверьте подключение Apple TV к интернету и доступность YouTube."
-                                return {
-                                    "status": "SUCCESS",
-                                    "message": f"Открыто на {atv.name}" + (f" ({context})" if context else "") + warning_msg,
-                                    "method": "airplay" + ("_remux" if self._last_merge_used else ""),
-                                    "merge_used": self._last_merge_used,
-                                }
-                            raise
+                            if err.status_code != 500:
+                                raise
+                            logger.info("HTTP 500 from Apple TV (known pyatv issue with /playback-info) - playback likely started%s, treating as success", (" - " + context) if context else "")
                         except Exception as err:
                             err_str = str(err).lower()
-                            if "500" in err_str and "internal server error" in err_str:
-                                logger.info(f"HTTP 500 detected in error message{(' - ' + context) if context else ''} - playback likely started, treating as success")
-                                warning_msg = ""
-                                if self._last_merge_used and "/stream/" in url_to_play:
-                                    warning_msg = f" Если воспроизведение не началось, проверьте доступность URL с Apple TV: {url_to_play}"
-                                elif not self._last_merge_used and ("googlevideo.com" in url_to_play or "youtube.com" in url_to_play):
-                                    warning_msg = " Если воспроизведение не началось, проверьте подключение Apple TV к интернету и доступность YouTube."
-                                return {
-                                    "status": "SUCCESS",
-                                    "message": f"Открыто на {atv.name}" + (f" ({context})" if context else "") + warning_msg,
-                                    "method": "airplay" + ("_remux" if self._last_merge_used else ""),
-                                    "merge_used": self._last_merge_used,
-                                }
-                            raise
+                            if "500" not in err_str or "internal server error" not in err_str:
+                                raise
+                            logger.info("HTTP 500 detected in error message%s - playback likely started, treating as success", (" - " + context) if context else "")
+                        return _playback_500_success(atv_name, url_to_play, context, merge_used)
                     
                     # For HLS with VidHub failed, skip raw playback attempt
                     if skip_raw_hls:
                         play_err = Exception("VidHub not available, skipping raw HLS playback")
                     else:
-                        logger.info("Playing URL via AirPlay (HA-style): %s", play_url_final[:80] + ("..." if len(play_url_final) > 80 else ""))
+                        logger.info("Playing URL via AirPlay (HA-style): %.80s%s", play_url_final, "..." if len(play_url_final) > 80 else "")
                         try:
                             result_500 = await play_url_with_500_handling(play_url_final)
                             if result_500:
@@ -650,41 +1080,40 @@ class AppleTVService:
                     
                     if play_err:
                         err_str = str(play_err).lower()
-                        err_msg = str(play_err)
-                        logger.debug(f"AirPlay error: {err_msg}, is_direct_media={is_direct_media}, is_hls={self._is_hls_url(url) if is_direct_media else False}, vidhub_failed={vidhub_failed}")
+                        logger.debug("AirPlay error: %s, is_direct_media=%s, is_hls=%s, vidhub_failed=%s", err_str, is_direct_media, hls_direct, vidhub_failed)
                         # Retry with conversion if Apple TV rejected (RTSP 400 / HTTP 500 for HLS / format)
                         # HTTP 500 can mean Apple TV accepted URL but can't load the stream (e.g. HLS not supported)
-                        should_retry = skip_raw_hls or ("400" in err_str or "rtsp" in err_str or "bad request" in err_str or 
-                                       (is_direct_media and self._is_hls_url(url) and ("500" in err_str or "internal server error" in err_str)))
-                        logger.debug(f"should_retry={should_retry}, skip_raw_hls={skip_raw_hls}, checking: 400={('400' in err_str)}, rtsp={('rtsp' in err_str)}, bad_request={('bad request' in err_str)}, hls_500={is_direct_media and self._is_hls_url(url) and ('500' in err_str or 'internal server error' in err_str)}")
+                        hls_500 = hls_direct and any(t in err_str for t in _HLS_500_TOKENS)
+                        should_retry = skip_raw_hls or any(t in err_str for t in _RETRY_TOKENS) or hls_500
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug(
+                                "should_retry=%s, skip_raw_hls=%s, checking: 400=%s, rtsp=%s, bad_request=%s, hls_500=%s",
+                                should_retry, skip_raw_hls, "400" in err_str, "rtsp" in err_str, "bad request" in err_str, hls_500,
+                            )
                         if should_retry:
-                            if is_direct_media and self._is_hls_url(url):
+                            if hls_direct:
                                 try:
-                                    from app.stream_merge import create_hls_session, wait_hls_prewarm
                                     stream_id = create_hls_session(url)
                                     play_url_final = f"{base}/api/appletv/stream/{stream_id}"
-                                    self._last_merge_used = True
+                                    merge_used = True
                                     logger.info("HLS failed, retrying with HLS→MP4 remux: %s", stream_id)
                                     logger.info("Remux stream URL for Apple TV: %s", play_url_final)
-                                    # Wait for pre-warm (64KB) so Apple TV gets data immediately and RTSP SETUP succeeds
-                                    prewarm_ok = await wait_hls_prewarm(stream_id, timeout=15.0, min_bytes=65536)
-                                    if not prewarm_ok:
-                                        logger.warning("HLS pre-warm incomplete, but proceeding anyway")
+                                    # Pre-warm (64KB) runs alongside the AirPlay command: GET /stream itself waits for
+                                    # the first data, so Apple TV still gets bytes as soon as ffmpeg has them
+                                    prewarm_task = asyncio.ensure_future(wait_hls_prewarm(stream_id, timeout=15.0, min_bytes=65536))
+                                    prewarm_task.add_done_callback(_warn_if_prewarm_incomplete)
                                     logger.info("Sending remux URL to Apple TV via AirPlay...")
                                     logger.info("NOTE: If playback doesn't start, check that Apple TV can access: %s", play_url_final)
                                     logger.info("Apple TV IP: %s, Stream URL: %s", address, play_url_final)
-                                    result_500 = await play_url_with_500_handling(play_url_final, "HLS remux")
+                                    result_500 = await play_url_with_500_handling(play_url_final, "HLS remux", merge_used)
                                     if result_500:
-                                        # Check if Apple TV requested the stream (wait a bit for request)
-                                        await asyncio.sleep(3.0)  # Give Apple TV more time to request stream
-                                        from app.stream_merge import get_merge_session
-                                        session = get_merge_session(stream_id)
-                                        if session and not session.get("requested", False):
-                                            logger.warning("[stream %s] Apple TV (%s) did not request stream - URL may not be accessible from Apple TV", stream_id, address)
-                                            logger.warning("[stream %s] Troubleshooting: 1) Check if %s is accessible from Apple TV network", stream_id, play_url_final)
-                                            logger.warning("[stream %s] Troubleshooting: 2) Check firewall on server (port 8100)", stream_id)
-                                            logger.warning("[stream %s] Troubleshooting: 3) Verify STREAM_BASE_URL matches server IP accessible from Apple TV", stream_id)
-                                            result_500["message"] += f" ВНИМАНИЕ: Apple TV ({address}) не запросил поток. Проверьте: 1) доступность {play_url_final} с Apple TV, 2) firewall (порт 8100), 3) правильность STREAM_BASE_URL."
+                                        # Check if Apple TV requested the stream (returns as soon as it does)
+                                        if not await wait_for_request(stream_id, timeout=3.0):
+                                            logger.warning(_LOG_NOT_REQUESTED, stream_id, address)
+                                            logger.warning(_LOG_TROUBLESHOOT_URL, stream_id, play_url_final)
+                                            logger.warning(_LOG_TROUBLESHOOT_FIREWALL, stream_id)
+                                            logger.warning(_LOG_TROUBLESHOOT_BASE_URL, stream_id)
+                                            result_500["message"] += _HLS_NOT_REQUESTED_MSG.format(address=address, url=play_url_final)
                                         else:
                                             logger.info("[stream %s] Apple TV successfully requested stream", stream_id)
                                         return result_500
@@ -693,13 +1122,16 @@ class AppleTVService:
                                     logger.warning("HLS remux retry failed: %s", e2, exc_info=True)
                                     return {
                                         "status": "HLS_REMUX_FAILED",
-                                        "message": f"HLS-поток не воспроизводится напрямую. Remux не удался: {err_detail}. Убедитесь, что STREAM_BASE_URL ({base}) доступен с Apple TV (откройте в браузере с телефона в той же Wi‑Fi).",
-                                        "device_name": atv.name,
+                                        "message": _HLS_REMUX_FAIL_MSG.format(err_detail=err_detail, base=base),
+                                        "device_name": atv_name,
                                     }
                             elif is_deep_link and not is_direct_media and quality in ("720p", "1080p", "auto"):
                                 try:
-                                    from app.stream_merge import get_video_audio_urls, create_merge_session
-                                    merge_info = await get_video_audio_urls(url, quality if quality != "auto" else "720p")
+                                    # Same worker processes as _resolve_stream_url: yt-dlp stays off the event loop's GIL
+                                    ydl_executor = self._get_ydl_executor()
+                                    merge_info = await get_video_audio_urls(
+                                        url, quality if quality != "auto" else "720p", ydl_executor
+                                    )
                                     if merge_info:
                                         stream_id = create_merge_session(
                                             merge_info["video_url"],
@@ -708,47 +1140,57 @@ class AppleTVService:
                                         )
                                         play_url_final = f"{base}/api/appletv/stream/{stream_id}"
                                         resolved_quality = f"{merge_info.get('height') or (quality if quality != 'auto' else '720')}p" if merge_info.get("height") else (quality if quality != "auto" else "720p")
-                                        self._last_merge_used = True
+                                        merge_used = True
                                         logger.info("Direct stream failed, retrying with merge (quality: %s)", resolved_quality)
-                                        result_500 = await play_url_with_500_handling(play_url_final, f"YouTube {resolved_quality} merge")
+                                        result_500 = await play_url_with_500_handling(play_url_final, f"YouTube {resolved_quality} merge", merge_used)
                                         if result_500:
-                                            # Check if Apple TV requested the stream (wait a bit for request)
-                                            await asyncio.sleep(2.0)  # Give Apple TV time to request stream
-                                            from app.stream_merge import get_merge_session
-                                            session = get_merge_session(stream_id)
-                                            if session and not session.get("requested", False):
-                                                logger.warning("[stream %s] Apple TV did not request stream - URL may not be accessible from Apple TV", stream_id)
-                                                result_500["message"] += f" ВНИМАНИЕ: Apple TV не запросил поток. Проверьте доступность URL с Apple TV: {play_url_final}"
+                                            # Check if Apple TV requested the stream (returns as soon as it does)
+                                            if not await wait_for_request(stream_id, timeout=2.0):
+                                                logger.warning(_LOG_NOT_REQUESTED, stream_id, address)
+                                                result_500["message"] += _MERGE_NOT_REQUESTED_MSG.format(url=play_url_final)
                                             return result_500
                                     else:
                                         raise play_err
                                 except Exception as e2:
                                     if e2 is play_err:
                                         raise
+                                    if isinstance(e2, BrokenProcessPool):
+                                        self._drop_ydl_executor(ydl_executor)
                                     logger.warning("Merge retry failed: %s", e2)
                                     raise play_err
                             else:
                                 raise play_err
                         else:
                             raise play_err
-                    msg = f"Воспроизведение на {atv.name}"
+                    msg = f"Воспроизведение на {atv_name}"
                     if resolved_quality:
                         msg += f" • качество: {resolved_quality}"
-                    if self._last_merge_used:
+                    if merge_used:
                         msg += " • склейка на сервере"
                     return {
                         "status": "SUCCESS",
                         "message": msg,
                         "method": "airplay",
                         "resolved_quality": resolved_quality,
-                        "merge_used": self._last_merge_used,
+                        "merge_used": merge_used,
                     }
                 else:
                     raise ValueError("Neither Apps nor Stream interface available on this device")
+            except BaseException:
+                keep_connection = False
+                raise
             finally:
-                atv_instance.close()
+                # An app deep link handled it (or we failed first): the speculative resolve isn't needed
+                if resolve_task is not None and not resolve_task.done():
+                    resolve_task.cancel()
+                if keep_connection:
+                    self._release_connection(conn_key, atv, atv_instance)
+                else:
+                    atv_instance.close()
         except Exception as e:
-            logger.error(f"Error playing/launching URL: {e}", exc_info=True)
+            if reused and isinstance(e, _STALE_CONNECTION_ERRORS):
+                raise _StaleConnection() from e
+            logger.error("Error playing/launching URL: %s", e, exc_info=True)
             err_lower = str(e).lower()
             if "not authenticated" in err_lower or "authentication" in err_lower or "pairing" in err_lower:
                 raise ValueError(
@@ -764,38 +1206,84 @@ class AppleTVService:
     ) -> Dict[str, Any]:
         """Stop AirPlay stream: send Menu (back) to exit playback and end the stream."""
         try:
-            loop = asyncio.get_event_loop()
-            atvs = await scan(
-                loop=loop,
-                hosts=[str(address)],
-                protocol={Protocol.AirPlay, Protocol.Companion, Protocol.MRP},
-            )
-            if not atvs:
-                raise ValueError(f"Device not found at {address}")
-            atv = atvs[0]
-            storage = DatabaseStorage(credentials_json)
-            device_identifier = str(atv.identifier) if hasattr(atv, "identifier") else str(atv.address)
-            stored_creds = storage.load(device_identifier)
-            if stored_creds:
-                creds_dict = stored_creds if isinstance(stored_creds, dict) else {}
-                airplay_service = atv.get_service(Protocol.AirPlay)
-                if airplay_service:
-                    airplay_creds = creds_dict.get("airplay") or creds_dict.get("AirPlay") or creds_dict.get("credentials")
-                    if airplay_creds:
-                        airplay_service.credentials = airplay_creds if isinstance(airplay_creds, str) else airplay_creds.get("credentials") or airplay_creds
-            atv_instance = await connect(atv, loop=loop)
-            try:
-                rc = atv_instance.remote_control
-                if rc:
-                    await rc.menu()
-                    return {"status": "SUCCESS", "message": f"Трансляция остановлена на {atv.name}"}
-                raise ValueError("Remote control not available")
-            finally:
-                atv_instance.close()
+            conn_key = (str(address), credentials_json or "")
+            atv, atv_instance, _, reused = await self._acquire_atv(address, credentials_json)
+            while True:
+                try:
+                    rc = atv_instance.remote_control
+                    if rc:
+                        await rc.menu()
+                        result = {"status": "SUCCESS", "message": f"Трансляция остановлена на {atv.name}"}
+                    else:
+                        raise ValueError("Remote control not available")
+                except _STALE_CONNECTION_ERRORS as e:
+                    atv_instance.close()
+                    if not reused:
+                        raise
+                    logger.info("Cached connection to %s went stale (%s), reconnecting", address, e)
+                    atv, atv_instance, _, reused = await self._acquire_atv(address, credentials_json, False)
+                    continue
+                except BaseException:
+                    atv_instance.close()
+                    raise
+                break
+            self._release_connection(conn_key, atv, atv_instance)
+            return result
         except Exception as e:
-            logger.error(f"Error stopping playback: {e}", exc_info=True)
+            logger.error("Error stopping playback: %s", e, exc_info=True)
             raise
 
+    def _apply_credentials(self, atv: Any, credentials_json: Optional[str]) -> bool:
+        """Set stored AirPlay/Companion/MRP credentials on the scanned config's services. Returns whether AirPlay has any."""
+        device_identifier = str(atv.identifier) if hasattr(atv, 'identifier') else str(atv.address)
+        stored_creds = self.get_parsed_credentials(credentials_json).get(device_identifier)
+        logger.info("Loading credentials for device %s, found: %s", device_identifier, stored_creds is not None)
+        creds_dict = stored_creds if isinstance(stored_creds, dict) else {}
+        has_airplay_creds = False
+        for protocol, keys in _CRED_KEYS:
+            creds = _pick_creds(creds_dict, keys)
+            if not creds:
+                continue
+            has_airplay_creds = has_airplay_creds or protocol is Protocol.AirPlay
+            service = atv.get_service(protocol)
+            if service:
+                service.credentials = creds
+                logger.info("Set %s credentials for %s", protocol.name, device_identifier)
+        return has_airplay_creds
+
+    async def _acquire_atv(
+        self, address: str, credentials_json: Optional[str], reuse: bool = True
+    ) -> Tuple[Any, AppleTV, bool, bool]:
+        """(config, connected instance, has AirPlay credentials, reused) for a play/stop command.
+        Reuses a connection kept by _release_connection (unless reuse is False), else scans (cached) and connects.
+        The caller owns the instance: hand it back with _release_connection or close it."""
+        cached_conn = self._take_connection((str(address), credentials_json or ""))
+        if cached_conn:
+            atv, atv_instance = cached_conn
+            if reuse:
+                return atv, atv_instance, self._apply_credentials(atv, credentials_json), True
+            atv_instance.close()
+        # Exclude DMAP to avoid pyatv login_id None error on Apple TV 3rd gen
+        atvs = await self._cached_scan(address, _SCAN_PROTOCOLS)
+        if not atvs:
+            raise ValueError(f"Device not found at {address}")
+        atv = atvs[0]
+        # Credentials go on the config before connecting
+        has_airplay_creds = self._apply_credentials(atv, credentials_json)
+        try:
+            async with _CONNECT_SEM:
+                atv_instance = await connect(atv, loop=asyncio.get_running_loop())
+        except Exception:
+            # A failure may mean a stale cached scan
+            self._invalidate_scan(address)
+            raise
+        return atv, atv_instance, has_airplay_creds, False
+
+    def get_parsed_credentials(self, credentials_json: Optional[str]) -> Dict[str, Any]:
+        """Parsed credentials for read-only use (play/stop). Cached by JSON content, so new credentials
+        after re-pairing are a different key."""
+        return parse_credentials_cached(credentials_json)
+
     def get_stored_credentials(self, credentials_json: Optional[str]) -> Dict[str, Any]:
         """Get credentials from database JSON."""
         storage = DatabaseStorage(credentials_json)
@@ -804,11 +1292,10 @@ class AppleTVService:
     async def add_device_manually(self, address: str, name: Optional[str] = None) -> Dict[str, Any]:
         """Manually add a device by IP address."""
         try:
-            logger.info(f"Manually adding device at {address}")
-            loop = asyncio.get_event_loop()
+            logger.info("Manually adding device at %s", address)
             
-            # Try to scan for the device at the given address
-            atvs = await scan(loop=loop, hosts=[str(address)])
+            # Try to scan for the device at the given address (same protocol set as play/stop, so they reuse this scan)
+            atvs = await self._cached_scan(address, _SCAN_PROTOCOLS)
             
             if not atvs:
                 # Device not found, but create entry anyway with provided info
@@ -819,31 +1306,26 @@ class AppleTVService:
                     "protocols": ["airplay", "companion"],  # Default assumptions
                     "identifier": None,
                 }
-                logger.warning(f"Device not found at {address}, creating entry anyway")
+                logger.warning("Device not found at %s, creating entry anyway", address)
                 return device_info
             
             # Device found, get real info
             atv = atvs[0]
-            protocols = []
-            if atv.get_service(Protocol.AirPlay):
-                protocols.append("airplay")
-            if atv.get_service(Protocol.Companion):
-                protocols.append("companion")
-            if atv.get_service(Protocol.MRP):
-                protocols.append("mrp")
+            protocols = _protocol_names(atv)
+            atv_address = str(atv.address)
             
             device_info = {
-                "device_id": f"{atv.address}_{atv.name}",
+                "device_id": f"{atv_address}_{atv.name}",
                 "name": atv.name,
-                "address": str(atv.address),
+                "address": atv_address,
                 "protocols": protocols,
                 "identifier": str(atv.identifier) if hasattr(atv, 'identifier') else None,
             }
             
-            logger.info(f"Found device: {device_info['name']} at {device_info['address']}")
+            logger.info("Found device: %s at %s", device_info["name"], device_info["address"])
             return device_info
         except Exception as e:
-            logger.error(f"Error manually adding device: {e}", exc_info=True)
+            logger.error("Error manually adding device: %s", e, exc_info=True)
             # Return device info anyway so user can add it
             return {
                 "device_id": f"{address}_{name or 'Apple TV'}",
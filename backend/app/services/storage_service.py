@@ -1,6 +1,7 @@
 """Storage service for pyatv credentials."""
-import json
+import functools
 import logging
+import orjson
 from typing import Optional, Dict, Any
 from pyatv import storage
 from pyatv.storage.file_storage import FileStorage
@@ -14,13 +15,12 @@ class DatabaseStorage:
     
     def __init__(self, credentials_json: Optional[str] = None):
         """Initialize with credentials from database JSON string."""
-        self._credentials = {}
-        if credentials_json:
-            try:
-                self._credentials = json.loads(credentials_json)
-            except json.JSONDecodeError:
-                logger.warning("Failed to parse credentials JSON")
-                self._credentials = {}
+        # Shallow copy of the shared parse: save/remove only replace top-level entries, never mutate them
+        self._credentials = dict(_parse_credentials_json(credentials_json))
+        # Serialized form, reset by save/remove; an unchanged storage hands back the JSON it was built from
+        self._json: Optional[str] = credentials_json if self._credentials else None
+        # load() results per identifier (key-normalized), reset by save/remove
+        self._loaded: Dict[str, Any] = {}
     
     def save(self, identifier: str, credentials: Dict[str, Any]) -> None:
         """Save credentials for a device. Merges with existing so we keep both AirPlay and Companion."""
@@ -31,28 +31,67 @@ class DatabaseStorage:
         if isinstance(credentials, dict):
             merged = {**(existing or {}), **credentials}
             self._credentials[identifier] = merged
-            logger.debug(f"Merged and saved credentials for {identifier} (keys: {list(merged.keys())})")
+            self._json = None
+            self._loaded.pop(identifier, None)
+            logger.debug("Merged and saved credentials for %s (keys: %s)", identifier, list(merged))
         else:
             self._credentials[identifier] = credentials
-            logger.debug(f"Saved credentials for {identifier}")
+            self._json = None
+            self._loaded.pop(identifier, None)
+            logger.debug("Saved credentials for %s", identifier)
     
     def load(self, identifier: str) -> Optional[Dict[str, Any]]:
-        """Load credentials for a device."""
-        return self._credentials.get(identifier)
+        """Load credentials for a device, protocol keys lowercased ("AirPlay" -> "airplay"). Treat the result as read-only."""
+        if identifier not in self._loaded:
+            self._loaded[identifier] = normalize_credential_keys(self._credentials.get(identifier))
+        return self._loaded[identifier]
     
     def remove(self, identifier: str) -> None:
         """Remove credentials for a device."""
         if identifier in self._credentials:
             del self._credentials[identifier]
-            logger.debug(f"Removed credentials for {identifier}")
+            self._json = None
+            self._loaded.pop(identifier, None)
+            logger.debug("Removed credentials for %s", identifier)
     
     def get_all(self) -> Dict[str, Dict[str, Any]]:
         """Get all stored credentials."""
         return self._credentials.copy()
     
     def to_json(self) -> str:
-        """Serialize credentials to JSON string for database storage."""
-        return json.dumps(self._credentials)
+        """Serialize credentials to JSON string for database storage (cached until the next save/remove)."""
+        if self._json is None:
+            self._json = orjson.dumps(self._credentials).decode()
+        return self._json
+
+
+@functools.lru_cache(maxsize=16)
+def _parse_credentials_json(credentials_json: Optional[str]) -> Dict[str, Any]:
+    """Parse once per distinct credentials string (play → stop → play sends the same one). Read-only result."""
+    if not credentials_json:
+        return {}
+    try:
+        parsed = orjson.loads(credentials_json)
+    except orjson.JSONDecodeError:
+        logger.warning("Failed to parse credentials JSON")
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+def normalize_credential_keys(creds: Any) -> Any:
+    """Lowercase a device's protocol keys; where both spellings exist the lowercase one wins."""
+    if not isinstance(creds, dict):
+        return creds
+    return {k.lower(): v for k, v in creds.items() if k.islower() or k.lower() not in creds}
+
+
+@functools.lru_cache(maxsize=64)
+def parse_credentials_cached(credentials_json: Optional[str]) -> Dict[str, Any]:
+    """Parse credentials JSON once per distinct string, protocol keys lowercased. Result is shared: treat it as read-only."""
+    return {
+        identifier: normalize_credential_keys(creds)
+        for identifier, creds in _parse_credentials_json(credentials_json).items()
+    }
 
 
 def create_storage_from_db(credentials_json: Optional[str]) -> DatabaseStorage:
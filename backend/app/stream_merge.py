@@ -1,303 +1,345 @@
 """Merge video+audio streams (e.g. YouTube DASH) and serve for AirPlay. HLS→MP4 remux for direct .m3u8 URLs."""
 import asyncio
+import importlib.util
 import logging
 import os
-import queue
-import threading
-import uuid
-from typing import Optional, Dict, Any
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Executor
+from typing import Optional, Dict, Any, Tuple
+
+from app.ydl_pool import acquire_ydl, release_ydl
 
 logger = logging.getLogger(__name__)
 
 # In-memory sessions: stream_id -> { "video_url", "audio_url" } for merge, or { "hls_url" } for HLS→MP4
 _sessions: Dict[str, Dict[str, Any]] = {}
 _SESSION_TTL_SEC = 3600
-_PREWARM_QUEUE_MAXSIZE = 128
+_SESSION_REAP_INTERVAL_SEC = 60.0
+_IDLE_CLOSE_SEC = 10.0  # grace after the last client disconnects (Apple TV probes a range, then re-requests)
+# Per-consumer backlog in chunks; reads are up to _FFMPEG_READ_BYTES, so this bounds it at ~32MB
+_CONSUMER_QUEUE_MAXSIZE = 32
+_CONSUMER_STALL_SEC = 30.0  # with several clients, drop one that hasn't taken a chunk for this long
 _BROADCAST_BUFFER_BYTES = 2 * 1024 * 1024  # 2MB replay for late-joining consumers (e.g. Apple TV after another client)
+_BROADCAST_BUFFER_CHUNKS = 2048  # also cap the count: tiny ffmpeg writes would otherwise mean long replays
+_STREAM_SEND_BYTES = 256 * 1024  # coalesce already-queued chunks up to this size per HTTP send
+# Faster start: minimal probe and no buffering during stream analysis so first bytes arrive sooner
+# (Apple TV may time out otherwise). Per input: ffmpeg input options only apply to the next -i.
+_FAST_INPUT_OPTS = ("-probesize", "32K", "-analyzeduration", "500000", "-fflags", "+nobuffer")
+# googlevideo drops long-lived connections: reconnect instead of ending the stream early (http(s) inputs only)
+_RECONNECT_OPTS = ("-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "2")
+# Command templates, built once; per stream only the input URLs are spliced in
+_FFMPEG_HEAD = ("ffmpeg", "-y", "-loglevel", "error")
+_MERGE_INPUT_OPTS = (*_FAST_INPUT_OPTS, *_RECONNECT_OPTS)
+_MERGE_CMD_TAIL = (
+    "-c", "copy",
+    "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+    "-f", "mp4", "pipe:1",
+)
+_HLS_CMD_HEAD = (
+    *_FFMPEG_HEAD, *_FAST_INPUT_OPTS,
+    "-protocol_whitelist", "file,http,https,tcp,tls",
+    "-allowed_extensions", "ALL",
+)
+_HLS_CMD_TAIL = (
+    "-c", "copy",
+    "-bsf:a", "aac_adtstoasc",  # Convert AAC ADTS to MP4-compatible format (HLS often uses ADTS)
+    "-movflags", "frag_keyframe+empty_moov+default_base_moof",  # faststart not needed for streaming
+    "-f", "mp4", "pipe:1",
+)
+_FFMPEG_READ_BYTES = 1024 * 1024  # max per read: returns whatever ffmpeg has written, so no added latency
+# yt-dlp video+audio lookups by (url, quality): retries / casting to another device skip extraction.
+# Kept well below the signed URLs' own lifetime since format URLs drift.
+_URLS_CACHE_TTL_SEC = 240.0
+_URLS_CACHE_MAX = 64
+_urls_cache: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_urls_inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+# quality -> yt-dlp format string for separate video + audio
+_MERGE_FORMAT_TABLE = {
+    "1080p": "bestvideo[height<=1080]+bestaudio/best",
+    "720p": "bestvideo[height<=720]+bestaudio/best",
+}
+_MERGE_FORMAT_DEFAULT = "bestvideo+bestaudio/best"
 
 
 def _get_video_audio_urls_blocking(url: str, quality: str) -> Optional[Dict[str, Any]]:
     """Get separate video and audio URLs from yt-dlp for merging (run in executor)."""
-    try:
-        import yt_dlp
-    except ImportError:
+    if importlib.util.find_spec("yt_dlp") is None:
         return None
     try:
-        if quality == "1080p":
-            format_str = "bestvideo[height<=1080]+bestaudio/best"
-        elif quality == "720p":
-            format_str = "bestvideo[height<=720]+bestaudio/best"
-        else:
-            format_str = "bestvideo+bestaudio/best"
-        opts = {
-            "format": format_str,
-            "skip_download": True,
-            "quiet": True,
-            "no_warnings": True,
-        }
-        with yt_dlp.YoutubeDL(opts) as ydl:
+        format_str = _MERGE_FORMAT_TABLE.get(quality, _MERGE_FORMAT_DEFAULT)
+        # Warm instance from the shared pool (same worker processes as stream URL resolution)
+        ydl = acquire_ydl(format_str)
+        try:
             info = ydl.extract_info(url, download=False)
-        if not info or not info.get("requested_formats") or len(info["requested_formats"]) < 2:
+        finally:
+            release_ydl(format_str, ydl)
+        rf = info.get("requested_formats") if info else None
+        if not rf or len(rf) < 2:
             return None
-        video_url = None
-        audio_url = None
-        for f in info["requested_formats"]:
-            u = f.get("url")
-            if not u:
-                continue
-            if f.get("vcodec") != "none":
-                video_url = u
-            if f.get("acodec") != "none":
-                audio_url = u
-        if video_url and audio_url:
-            height = info.get("height")
-            if not height and info.get("requested_formats"):
-                for rf in info["requested_formats"]:
-                    if rf.get("height"):
-                        height = rf["height"]
-                        break
-            return {"video_url": video_url, "audio_url": audio_url, "height": height}
+        # bestvideo+bestaudio: one video-only and one audio-only entry
+        v = next((f for f in rf if f.get("url") and f.get("vcodec") != "none"), None)
+        a = next((f for f in rf if f.get("url") and f.get("acodec") != "none"), None)
+        if v and a:
+            return {"video_url": v["url"], "audio_url": a["url"], "height": info.get("height") or v.get("height")}
         return None
     except Exception as e:
         logger.warning("Could not get video+audio URLs: %s", e)
         return None
 
 
-def _producer_merge(stream_id: str, broadcast_queue: queue.Queue) -> None:
-    """Run ffmpeg merge and put chunks into broadcast queue. Call from background thread."""
+async def _producer(session: Dict[str, Any], stream_id: str, runner, label: str) -> None:
+    """Run the session's ffmpeg (runner) and broadcast chunks to consumers. Runs as a task on the event loop.
+    Holds the session itself: it keeps streaming to its consumers even after expiring from _sessions."""
     first_chunk = True
     chunk_count = 0
     try:
-        for chunk in _run_ffmpeg_merge(stream_id):
+        async for chunk in runner(stream_id):
             if chunk:
                 chunk_count += 1
                 if first_chunk:
-                    logger.info("[stream %s] FFmpeg: first data ready (pre-warm)", stream_id)
+                    logger.info("[stream %s] %s: first data ready (pre-warm)", stream_id, label)
                     first_chunk = False
-                broadcast_queue.put(chunk)
+                await _broadcast(session, chunk)
     except Exception as e:
-        logger.warning("Merge producer error for %s: %s", stream_id, e)
+        logger.warning("[stream %s] %s producer error: %s", stream_id, label, e)
     finally:
-        broadcast_queue.put(None)
+        await _broadcast(session, None)
         if chunk_count == 0:
-            logger.warning("[stream %s] FFmpeg: stream finished with no data (check FFmpeg exit log above)", stream_id)
+            logger.warning("[stream %s] %s: stream finished with no data (check FFmpeg exit log above)", stream_id, label)
         else:
-            logger.info("[stream %s] FFmpeg: stream finished (%s chunks)", stream_id, chunk_count)
+            logger.info("[stream %s] %s: stream finished (%s chunks)", stream_id, label, chunk_count)
+
+
+async def _broadcast(session: Dict[str, Any], chunk: Optional[bytes]) -> None:
+    """Keep a bounded replay buffer and put the chunk (None = end of stream) into every consumer queue."""
+    if chunk is not None:
+        buffer_list = session["buffer_list"]
+        buffer_list.append(chunk)
+        buffer_bytes = session["buffer_bytes"] + len(chunk)
+        evicted = 0
+        while buffer_list and (buffer_bytes - evicted > _BROADCAST_BUFFER_BYTES or len(buffer_list) > _BROADCAST_BUFFER_CHUNKS):
+            evicted += len(buffer_list.popleft())
+        session["buffer_bytes"] = buffer_bytes - evicted
+        session["buffer_offset"] += evicted
+        threshold = session["prewarm_threshold"]
+        if threshold is not None and session["buffer_bytes"] >= threshold:
+            session["prewarm_event"].set()
+    else:
+        session["prewarm_event"].set()  # no more data: let wait_hls_prewarm report what it got
+    # A full queue blocks the producer, so the slowest client throttles ffmpeg (and its upstream reads).
+    # A lone client may pause as long as it likes; with several, one stalled socket is cut off after
+    # _CONSUMER_STALL_SEC rather than freezing the others. consumers is replaced, never mutated,
+    # so iterating it is a snapshot.
+    consumers = session["consumers"]
+    for q in consumers:
+        try:
+            q.put_nowait(chunk)
+        except asyncio.QueueFull:
+            if len(consumers) == 1:
+                await q.put(chunk)
+                continue
+            try:
+                await asyncio.wait_for(q.put(chunk), timeout=_CONSUMER_STALL_SEC)
+            except asyncio.TimeoutError:
+                _drop_consumer(session, q)
 
 
-def _broadcaster_merge(stream_id: str, broadcast_queue: queue.Queue, consumers: list, buffer_list: list, buffer_lock: threading.Lock) -> None:
-    """Read from broadcast_queue, keep a bounded buffer, and put each chunk into every consumer queue."""
-    buffer_bytes = 0
-    try:
-        while True:
-            chunk = broadcast_queue.get()
-            if chunk is None:
-                with buffer_lock:
-                    for q in list(consumers):
-                        try:
-                            q.put(None)
-                        except Exception:
-                            pass
-                return
-            with buffer_lock:
-                buffer_list.append(chunk)
-                buffer_bytes += len(chunk)
-                while buffer_bytes > _BROADCAST_BUFFER_BYTES and buffer_list:
-                    old = buffer_list.pop(0)
-                    buffer_bytes -= len(old)
-                for q in list(consumers):
-                    try:
-                        q.put(chunk)
-                    except Exception:
-                        pass
-    except Exception as e:
-        logger.warning("[stream %s] Broadcaster error: %s", stream_id, e)
+def _drop_consumer(session: Dict[str, Any], q: asyncio.Queue) -> None:
+    """Disconnect a consumer that stalled while others are watching: discard its backlog and end its stream."""
+    session["consumers"] = tuple(c for c in session["consumers"] if c is not q)
+    while not q.empty():
+        q.get_nowait()
+    q.put_nowait(None)
+    logger.warning("Stream consumer too slow, disconnecting it (%s consumers left)", len(session["consumers"]))
 
 
-def create_merge_session(video_url: str, audio_url: str, height: Optional[int] = None) -> str:
-    """Store a merge session, start ffmpeg + broadcaster so multiple clients (e.g. Apple TV + browser) can get the same stream."""
-    import time
-    stream_id = str(uuid.uuid4())[:12]
-    broadcast_queue = queue.Queue(maxsize=_PREWARM_QUEUE_MAXSIZE)
-    consumers: list = []
-    buffer_list: list = []
-    buffer_lock = threading.Lock()
-    _sessions[stream_id] = {
-        "video_url": video_url,
-        "audio_url": audio_url,
-        "height": height,
+def _create_session(runner, label: str, **urls: Any) -> str:
+    """Store a session with its source URLs and start its producer task. Must be called from the event loop."""
+    stream_id = os.urandom(6).hex()
+    session = _sessions[stream_id] = {
+        **urls,
         "created_at": time.time(),
-        "broadcast_queue": broadcast_queue,
-        "consumers": consumers,
-        "buffer_list": buffer_list,
-        "buffer_lock": buffer_lock,
+        "consumers": (),  # copy-on-write tuple of consumer queues
+        "buffer_list": deque(),
+        "buffer_bytes": 0,
+        "buffer_offset": 0,  # stream bytes evicted from the head of buffer_list
+        "prewarm_threshold": None,  # buffer_bytes at which prewarm_event is set (see wait_hls_prewarm)
+        "prewarm_event": asyncio.Event(),
         "requested": False,  # Track if Apple TV requested the stream
+        "requested_event": asyncio.Event(),  # set together with "requested"
     }
-    t = threading.Thread(target=_producer_merge, args=(stream_id, broadcast_queue), daemon=True)
-    t.start()
-    b = threading.Thread(
-        target=_broadcaster_merge,
-        args=(stream_id, broadcast_queue, consumers, buffer_list, buffer_lock),
-        daemon=True,
-    )
-    b.start()
-    logger.info("[stream %s] Merge session created, FFmpeg started in background (Apple TV will request GET /stream/%s)", stream_id, stream_id)
+    # Keep a reference: the loop only holds tasks weakly
+    session["producer_task"] = asyncio.get_running_loop().create_task(_producer(session, stream_id, runner, label))
     return stream_id
 
 
-def _producer_hls(stream_id: str, broadcast_queue: queue.Queue) -> None:
-    """Run HLS→MP4 ffmpeg and put chunks into broadcast queue. Call from background thread."""
-    first_chunk = True
-    chunk_count = 0
-    try:
-        for chunk in _run_ffmpeg_hls_to_mp4(stream_id):
-            if chunk:
-                chunk_count += 1
-                if first_chunk:
-                    logger.info("[stream %s] HLS→MP4: first data ready (pre-warm)", stream_id)
-                    first_chunk = False
-                broadcast_queue.put(chunk)
-    except Exception as e:
-        logger.warning("[stream %s] HLS producer error: %s", stream_id, e)
-    finally:
-        broadcast_queue.put(None)
-        if chunk_count == 0:
-            logger.warning("[stream %s] HLS→MP4: no data (check ffmpeg)", stream_id)
-        else:
-            logger.info("[stream %s] HLS→MP4 finished (%s chunks)", stream_id, chunk_count)
+def create_merge_session(video_url: str, audio_url: str, height: Optional[int] = None) -> str:
+    """Store a merge session, start ffmpeg + broadcaster so multiple clients (e.g. Apple TV + browser) can get the same stream.
+    Must be called from the event loop."""
+    stream_id = _create_session(_run_ffmpeg_merge, "FFmpeg", video_url=video_url, audio_url=audio_url, height=height)
+    logger.info("[stream %s] Merge session created, FFmpeg started in background (Apple TV will request GET /stream/%s)", stream_id, stream_id)
+    return stream_id
 
 
 def create_hls_session(hls_url: str) -> str:
-    """Store HLS URL, start ffmpeg in background (pre-warm) so Apple TV gets data immediately."""
-    import time
-    stream_id = str(uuid.uuid4())[:12]
-    broadcast_queue = queue.Queue(maxsize=_PREWARM_QUEUE_MAXSIZE)
-    consumers: list = []
-    buffer_list: list = []
-    buffer_lock = threading.Lock()
-    _sessions[stream_id] = {
-        "hls_url": hls_url,
-        "created_at": time.time(),
-        "broadcast_queue": broadcast_queue,
-        "consumers": consumers,
-        "buffer_list": buffer_list,
-        "buffer_lock": buffer_lock,
-        "requested": False,  # Track if Apple TV requested the stream
-    }
-    t = threading.Thread(target=_producer_hls, args=(stream_id, broadcast_queue), daemon=True)
-    t.start()
-    b = threading.Thread(
-        target=_broadcaster_merge,
-        args=(stream_id, broadcast_queue, consumers, buffer_list, buffer_lock),
-        daemon=True,
-    )
-    b.start()
+    """Store HLS URL, start ffmpeg in background (pre-warm) so Apple TV gets data immediately.
+    Must be called from the event loop."""
+    stream_id = _create_session(_run_ffmpeg_hls_to_mp4, "HLS→MP4", hls_url=hls_url)
     logger.info("[stream %s] HLS session created, FFmpeg pre-warming (GET /stream/%s)", stream_id, stream_id)
     return stream_id
 
 
 def get_merge_session(stream_id: str) -> Optional[Dict[str, Any]]:
-    """Get session by id; remove if expired."""
-    import time
-    s = _sessions.get(stream_id)
-    if not s:
-        return None
-    if time.time() - s["created_at"] > _SESSION_TTL_SEC:
-        del _sessions[stream_id]
-        return None
-    return s
+    """Get session by id. Expiry is left to reap_sessions_loop, so this hot path is a plain dict lookup."""
+    return _sessions.get(stream_id)
 
 
-async def get_video_audio_urls(url: str, quality: str) -> Optional[Dict[str, Any]]:
-    """Async wrapper for getting video+audio URLs."""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, _get_video_audio_urls_blocking, url, quality)
+def _close_session(session: Dict[str, Any]) -> None:
+    """Stop a removed session's producer; cancelling it kills ffmpeg."""
+    task = session.get("producer_task")
+    if task is not None and not task.done():
+        task.cancel()
 
 
-def _run_ffmpeg_merge(stream_id: str):
-    """Run ffmpeg merge (video+audio) and yield chunks (blocking generator)."""
-    session = get_merge_session(stream_id)
-    if not session or "video_url" not in session:
+def _close_if_idle(stream_id: str) -> None:
+    """Stop ffmpeg once every client has gone away, instead of letting it pull the whole source until the TTL."""
+    s = _sessions.get(stream_id)
+    if not s or s["consumers"]:
         return
-    import subprocess
-    # Faster start: minimal probe so first bytes arrive sooner (Apple TV may timeout otherwise)
-    cmd = [
-        "ffmpeg", "-y", "-loglevel", "error",
-        "-probesize", "32K", "-analyzeduration", "500000",
-        "-i", session["video_url"],
-        "-i", session["audio_url"],
-        "-c", "copy",
-        "-movflags", "frag_keyframe+empty_moov+default_base_moof",
-        "-f", "mp4", "pipe:1",
+    task = s.get("producer_task")
+    if task is not None and not task.done():
+        logger.info("[stream %s] All clients disconnected, stopping FFmpeg", stream_id)
+        _close_session(_sessions.pop(stream_id))
+
+
+def reap_sessions() -> int:
+    """Remove expired sessions nobody is streaming from (e.g. cast cancelled before Apple TV connected). Returns count."""
+    now = time.time()
+    expired = [
+        stream_id for stream_id, s in _sessions.items()
+        if now - s["created_at"] > _SESSION_TTL_SEC and not s.get("consumers")
     ]
+    for stream_id in expired:
+        _close_session(_sessions.pop(stream_id))
+    return len(expired)
+
+
+async def reap_sessions_loop(interval: float = _SESSION_REAP_INTERVAL_SEC) -> None:
+    """Reap expired sessions every `interval` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        reaped = reap_sessions()
+        if reaped:
+            logger.info("Reaped %s expired stream sessions", reaped)
+
+
+def mark_requested(session: Dict[str, Any]) -> None:
+    """Record that a client (Apple TV) fetched the stream; wakes wait_for_request."""
+    session["requested"] = True
+    event = session.get("requested_event")
+    if event is not None:
+        event.set()
+
+
+async def wait_for_request(stream_id: str, timeout: float) -> bool:
+    """Wait until the stream is requested (returns as soon as it is). False on timeout or unknown session."""
+    session = get_merge_session(stream_id)
+    if not session:
+        return False
+    if session.get("requested"):
+        return True
     try:
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            bufsize=256 * 1024,
-        )
-        for chunk in iter(lambda: proc.stdout.read(65536), b""):
-            if chunk:
-                yield chunk
-        proc.wait()
+        await asyncio.wait_for(session["requested_event"].wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def get_video_audio_urls(url: str, quality: str, executor: Optional[Executor] = None) -> Optional[Dict[str, Any]]:
+    """Async wrapper for getting video+audio URLs. Successful lookups are reused for _URLS_CACHE_TTL_SEC;
+    concurrent callers for the same (url, quality) share one yt-dlp run.
+    executor: where yt-dlp runs (e.g. the resolver process pool); default thread pool if None."""
+    key = (url, quality)
+    cached = _urls_cache.get(key)
+    if cached:
+        if cached[0] > time.monotonic():
+            _urls_cache.move_to_end(key)
+            return cached[1]
+        del _urls_cache[key]
+    inflight = _urls_inflight.get(key)
+    if inflight is None:
+        inflight = _urls_inflight[key] = asyncio.ensure_future(_get_video_audio_urls_uncached(key, url, quality, executor))
+        inflight.add_done_callback(lambda _f: _urls_inflight.pop(key, None))
+    # shield: one caller going away must not cancel the lookup for the others
+    return await asyncio.shield(inflight)
+
+
+async def _get_video_audio_urls_uncached(
+    key: Tuple[str, str], url: str, quality: str, executor: Optional[Executor]
+) -> Optional[Dict[str, Any]]:
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(executor, _get_video_audio_urls_blocking, url, quality)
+    if result:
+        _urls_cache[key] = (time.monotonic() + _URLS_CACHE_TTL_SEC, result)
+        if len(_urls_cache) > _URLS_CACHE_MAX:
+            _urls_cache.popitem(last=False)
+    return result
+
+
+async def _ffmpeg_chunks(cmd: list, stream_id: str, label: str, err_limit: Optional[int] = None):
+    """Run ffmpeg as an asyncio subprocess and yield stdout chunks (no thread per stream).
+    ffmpeg is killed if the consumer stops early."""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        limit=2 * _FFMPEG_READ_BYTES,
+    )
+    try:
+        while chunk := await proc.stdout.read(_FFMPEG_READ_BYTES):
+            yield chunk
+        _, err = await proc.communicate()
         if proc.returncode != 0:
-            err = (proc.stderr.read() or b"").decode("utf-8", errors="replace").strip()
+            err = (err or b"").decode("utf-8", errors="replace").strip()
             if err:
-                logger.warning("[stream %s] FFmpeg exit %s: %s", stream_id, proc.returncode, err)
-    except Exception as e:
-        logger.warning("Stream merge ffmpeg error: %s", e)
+                logger.warning("[stream %s] %s exit %s: %s", stream_id, label, proc.returncode, err[:err_limit])
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
 
 
-def _run_ffmpeg_hls_to_mp4(stream_id: str):
-    """Run ffmpeg HLS→MP4 (remux, no re-encode) and yield chunks (blocking generator).
-    Optimized for AirPlay compatibility: fragmented MP4 with AAC bitstream filter."""
+async def _run_ffmpeg_merge(stream_id: str):
+    """Run ffmpeg merge (video+audio) and yield chunks (async generator)."""
     session = get_merge_session(stream_id)
-    if not session or "hls_url" not in session:
+    if not session or "video_url" not in session:
         return
-    import subprocess
-    hls_url = session["hls_url"]
-    cmd = [
-        "ffmpeg", "-y", "-loglevel", "error",
-        "-probesize", "32K", "-analyzeduration", "500000",
-        "-protocol_whitelist", "file,http,https,tcp,tls",
-        "-allowed_extensions", "ALL",
-        "-i", hls_url,
-        "-c", "copy",
-        "-bsf:a", "aac_adtstoasc",  # Convert AAC ADTS to MP4-compatible format (HLS often uses ADTS)
-        "-movflags", "frag_keyframe+empty_moov+default_base_moof",  # faststart not needed for streaming
-        "-f", "mp4", "pipe:1",
-    ]
+    cmd = (
+        *_FFMPEG_HEAD,
+        *_MERGE_INPUT_OPTS, "-i", session["video_url"],
+        *_MERGE_INPUT_OPTS, "-i", session["audio_url"],
+        *_MERGE_CMD_TAIL,
+    )
     try:
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            bufsize=256 * 1024,
-        )
-        for chunk in iter(lambda: proc.stdout.read(65536), b""):
-            if chunk:
-                yield chunk
-        proc.wait()
-        if proc.returncode != 0:
-            err = (proc.stderr.read() or b"").decode("utf-8", errors="replace").strip()
-            if err:
-                logger.warning("[stream %s] HLS→MP4 ffmpeg exit %s: %s", stream_id, proc.returncode, err[:500])
-    except Exception as e:
-        logger.warning("Stream HLS→MP4 ffmpeg error: %s", e)
+        async for chunk in _ffmpeg_chunks(cmd, stream_id, "FFmpeg"):
+            yield chunk
+    except OSError as e:
+        logger.warning("Stream merge ffmpeg error: %s", e)
 
 
-def _run_ffmpeg_stream(stream_id: str):
-    """Dispatch to merge or HLS→MP4 based on session type."""
+async def _run_ffmpeg_hls_to_mp4(stream_id: str):
+    """Run ffmpeg HLS→MP4 (remux, no re-encode) and yield chunks (async generator).
+    Optimized for AirPlay compatibility: fragmented MP4 with AAC bitstream filter."""
     session = get_merge_session(stream_id)
-    if not session:
+    if not session or "hls_url" not in session:
         return
-    if "hls_url" in session:
-        for chunk in _run_ffmpeg_hls_to_mp4(stream_id):
-            yield chunk
-    else:
-        for chunk in _run_ffmpeg_merge(stream_id):
+    cmd = (*_HLS_CMD_HEAD, "-i", session["hls_url"], *_HLS_CMD_TAIL)
+    try:
+        async for chunk in _ffmpeg_chunks(cmd, stream_id, "HLS→MP4 ffmpeg", err_limit=500):
             yield chunk
+    except OSError as e:
+        logger.warning("Stream HLS→MP4 ffmpeg error: %s", e)
 
 
 def _register_consumer(stream_id: str):
@@ -305,71 +347,58 @@ def _register_consumer(stream_id: str):
     session = get_merge_session(stream_id)
     if not session or "consumers" not in session:
         return None, None
-    consumers = session["consumers"]
     buffer_list = session["buffer_list"]
-    buffer_lock = session["buffer_lock"]
-    q = queue.Queue(maxsize=_PREWARM_QUEUE_MAXSIZE * 2)
+    q = asyncio.Queue(maxsize=_CONSUMER_QUEUE_MAXSIZE + len(buffer_list))
 
     def unregister():
-        try:
-            consumers.remove(q)
-        except ValueError:
-            pass
-
-    with buffer_lock:
-        for c in buffer_list:
-            try:
-                q.put(c)
-            except Exception:
-                break
-        consumers.append(q)
+        session["consumers"] = tuple(c for c in session["consumers"] if c is not q)
+        # Drop what's left so a producer blocked on put() for this queue moves on
+        while not q.empty():
+            q.get_nowait()
+        if not session["consumers"]:
+            asyncio.get_running_loop().call_later(_IDLE_CLOSE_SEC, _close_if_idle, stream_id)
+
+    for c in buffer_list:
+        q.put_nowait(c)
+    session["consumers"] += (q,)
     return q, unregister
 
 
 async def wait_hls_prewarm(stream_id: str, timeout: float = 15.0, min_bytes: int = 65536) -> bool:
-    """Wait until HLS session buffer has at least min_bytes so Apple TV gets immediate response. Returns True if ready."""
-    import time
+    """Wait until HLS session buffer has at least min_bytes so Apple TV gets immediate response. Returns True if ready.
+    Woken by the producer as soon as the buffer reaches min_bytes (one waiter per session)."""
     session = get_merge_session(stream_id)
-    if not session or "buffer_list" not in session or "buffer_lock" not in session:
+    if not session or "prewarm_event" not in session:
         return False
-    buffer_list = session["buffer_list"]
-    buffer_lock = session["buffer_lock"]
-    deadline = time.monotonic() + timeout
-    while time.monotonic() < deadline:
-        with buffer_lock:
-            total = sum(len(c) for c in buffer_list)
-        if total >= min_bytes:
-            logger.info("[stream %s] Pre-warm ready (%s bytes)", stream_id, total)
-            return True
-        await asyncio.sleep(0.15)
-    logger.warning("[stream %s] Pre-warm timeout (got %s bytes)", stream_id, sum(len(c) for c in buffer_list))
+    if session["buffer_bytes"] < min_bytes:
+        session["prewarm_threshold"] = min_bytes
+        try:
+            await asyncio.wait_for(session["prewarm_event"].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    total = session["buffer_bytes"]
+    if total >= min_bytes:
+        logger.info("[stream %s] Pre-warm ready (%s bytes)", stream_id, total)
+        return True
+    logger.warning("[stream %s] Pre-warm timeout (got %s bytes)", stream_id, total)
     return False
 
 
 async def wait_first_chunk_merge(stream_id: str, timeout: float = 25.0, min_buffer_bytes: int = 262144):
     """Register a consumer, wait for initial data (at least min_buffer_bytes or first chunk). Returns (initial_bytes, queue, unregister_cb) or (None, None, None)."""
-    import time
     session = get_merge_session(stream_id)
     if not session or "consumers" not in session:
         return None, None, None
     chunk_queue, unregister = _register_consumer(stream_id)
     if not chunk_queue:
         return None, None, None
-    loop = asyncio.get_event_loop()
     chunks = []
     total = 0
     deadline = time.monotonic() + timeout
-
-    def get_next():
-        return chunk_queue.get()
-
     try:
         while total < min_buffer_bytes:
             remaining = max(0.1, deadline - time.monotonic())
-            chunk = await asyncio.wait_for(
-                loop.run_in_executor(None, get_next),
-                timeout=remaining,
-            )
+            chunk = await asyncio.wait_for(chunk_queue.get(), timeout=remaining)
             if chunk is None:
                 break
             chunks.append(chunk)
@@ -386,76 +415,44 @@ async def wait_first_chunk_merge(stream_id: str, timeout: float = 25.0, min_buff
         return None, None, None
 
 
+def _coalesce_ready(chunk: bytes, chunk_queue: asyncio.Queue):
+    """Append chunks already waiting in the queue (up to _STREAM_SEND_BYTES) so each send carries more data.
+    Never blocks. Returns (data, ended) where ended means the end-of-stream marker was consumed."""
+    parts = [chunk]
+    total = len(chunk)
+    while total < _STREAM_SEND_BYTES:
+        try:
+            nxt = chunk_queue.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+        if nxt is None:
+            return b"".join(parts), True
+        parts.append(nxt)
+        total += len(nxt)
+    return (chunk if len(parts) == 1 else b"".join(parts)), False
+
+
 async def stream_merged_mp4_async(
     stream_id: str,
-    first_chunk: Optional[bytes] = None,
-    chunk_queue: Optional[queue.Queue] = None,
-    unregister_cb: Optional[Any] = None,
+    first_chunk: bytes,
+    chunk_queue: asyncio.Queue,
+    unregister_cb: Any,
 ):
-    """Async generator: yield chunks. Merge sessions use pre-warmed queue (ffmpeg already running)."""
-    session = get_merge_session(stream_id)
-    if not session:
-        return
-
-    if first_chunk is not None and chunk_queue is not None:
-        # Merge: first chunk already received by caller; yield it then rest from queue
-        try:
-            yield first_chunk
-            loop = asyncio.get_event_loop()
-            while True:
-                try:
-                    chunk = await asyncio.wait_for(
-                        loop.run_in_executor(None, chunk_queue.get),
-                        timeout=60.0,
-                    )
-                except asyncio.TimeoutError:
-                    logger.warning("Stream %s: no data within 60s", stream_id)
-                    break
-                if chunk is None:
-                    break
-                yield chunk
-        finally:
-            if unregister_cb:
-                unregister_cb()
-        return
-
-    if "chunk_queue" in session:
-        # Merge but no first chunk passed: yield from queue (e.g. HLS path)
-        chunk_queue = session["chunk_queue"]
-        loop = asyncio.get_event_loop()
+    """Async generator: yield the first chunk (already received via wait_first_chunk_merge), then the rest
+    of the session's stream from the consumer queue. Unregisters the consumer when done."""
+    try:
+        yield first_chunk
         while True:
             try:
-                chunk = await asyncio.wait_for(
-                    loop.run_in_executor(None, chunk_queue.get),
-                    timeout=60.0,
-                )
+                chunk = await asyncio.wait_for(chunk_queue.get(), timeout=60.0)
             except asyncio.TimeoutError:
                 logger.warning("Stream %s: no data within 60s", stream_id)
                 break
             if chunk is None:
                 break
+            chunk, ended = _coalesce_ready(chunk, chunk_queue)
             yield chunk
-        return
-
-    # HLS→MP4: no pre-warm, run ffmpeg in executor
-    q = queue.Queue(maxsize=16)
-
-    def run():
-        for chunk in _run_ffmpeg_stream(stream_id):
-            q.put(chunk)
-        q.put(None)
-
-    loop = asyncio.get_event_loop()
-    loop.run_in_executor(None, run)
-    while True:
-        try:
-            chunk = await asyncio.wait_for(
-                loop.run_in_executor(None, q.get),
-                timeout=45.0,
-            )
-        except asyncio.TimeoutError:
-            logger.warning("Stream %s: no data from ffmpeg within 45s", stream_id)
-            break
-        if chunk is None:
-            break
-        yield chunk
+            if ended:
+                break
+    finally:
+        unregister_cb()
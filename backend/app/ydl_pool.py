@@ -0,0 +1,34 @@
+"""Pool of warm yt_dlp.YoutubeDL instances, shared by stream URL resolution and video+audio merge lookups."""
+import threading
+from typing import Any, Dict, List
+
+# Idle YoutubeDL instances per format string: construction loads all extractors, so reuse warm ones.
+# Each instance keeps its HTTP handler (requests session with keep-alive) for the next extraction.
+_ydl_pool: Dict[str, List[Any]] = {}
+_ydl_pool_lock = threading.Lock()
+
+
+def acquire_ydl(format_str: str):
+    """Check out a YoutubeDL for format_str (idle one if any). Not shared: hand it back with release_ydl."""
+    with _ydl_pool_lock:
+        idle = _ydl_pool.get(format_str)
+        if idle:
+            return idle.pop()
+    import yt_dlp
+
+    return yt_dlp.YoutubeDL({
+        "format": format_str,
+        "skip_download": True,
+        "quiet": True,
+        "no_warnings": True,
+        "socket_timeout": 10,
+        # watch?v=...&list=... resolves the one video, not every playlist entry
+        "noplaylist": True,
+        # Adaptive formats come from the player response; the extra DASH manifest request adds nothing we play
+        "youtube_include_dash_manifest": False,
+    })
+
+
+def release_ydl(format_str: str, ydl) -> None:
+    with _ydl_pool_lock:
+        _ydl_pool.setdefault(format_str, []).append(ydl)
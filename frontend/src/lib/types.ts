@@ -18,6 +18,7 @@ export interface PairedDevice {
 	/** Protocols that have been paired (e.g. ["airplay", "companion"]) */
 	paired_protocols?: string[];
 	is_paired?: boolean; // True if device has actual credentials (was paired)
+	is_default?: boolean; // True if this is the default device
 	last_seen?: string;
 	created_at: string;
 }